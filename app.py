@@ -1,14 +1,106 @@
+import os
+import queue
+import threading
+from datetime import datetime
+from functools import partial
 from tkinter import *
-from tkinter import filedialog, font, ttk
-
-from app_utils import (
-    export_data,
-    parse_gene_text,
-    parse_rsid_text,
-    query_table,
-    read_file,
-    create_pretty_filename,
-)
+from tkinter import filedialog, ttk
+
+from instrumentation import QueryStats
+from result_table import ResultTable
+
+# app_utils pulls in pandas and numpy which take a while to import, so it is
+# imported on a background thread once the window is up. See load_library
+app_utils = None
+
+
+def load_library(task):
+    # Runs on a worker thread. Imports app_utils and loads the table and the
+    # lookups used for completions so the first query doesn't wait for them
+    global app_utils
+    task.report("Loading library...")
+    import app_utils as module
+
+    app_utils = module
+    task.report("Loading pharmacoscan table...")
+    try:
+        table = app_utils.get_store().get()
+        table.build_symbol_indexes()
+    except Exception:
+        # Any problem loading the table is reported when a query is submitted
+        return False
+    try:
+        app_utils.allele_store.get(table)
+    except Exception:
+        # Allele definitions are optional
+        pass
+    return True
+
+
+class BackgroundTask:
+    """Runs a function on a worker thread and hands its result back to Tk.
+
+    The function is called as target(task, *args) so it can post status text
+    with task.report() and check task.cancelled between steps. The callbacks
+    are always run from the Tk event loop and on_done is skipped once the task
+    has been cancelled.
+    """
+
+    poll_ms = 50
+
+    def __init__(self, root, target, on_done, on_error, on_status=None):
+        self.root = root
+        self.target = target
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_status = on_status
+        self._cancel_event = threading.Event()
+        self._queue = queue.Queue()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def start(self, *args):
+        thread = threading.Thread(target=self._run, args=args, daemon=True)
+        thread.start()
+        self.root.after(self.poll_ms, self._poll)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def report(self, text):
+        self._queue.put(("status", text))
+
+    def _run(self, *args):
+        try:
+            result = self.target(self, *args)
+        except Exception as ex:
+            self._queue.put(("error", ex))
+        else:
+            self._queue.put(("done", result))
+
+    def _poll(self):
+        while True:
+            try:
+                kind, value = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if self.cancelled:
+                # The worker only stops at its next check of cancelled so
+                # anything it sends after being cancelled is dropped
+                if kind != "status":
+                    return
+                continue
+            if kind == "status" and self.on_status is not None:
+                self.on_status(value)
+            elif kind == "done":
+                self.on_done(value)
+                return
+            elif kind == "error":
+                self.on_error(value)
+                return
+        self.root.after(self.poll_ms, self._poll)
 
 
 class EnteredData:
@@ -17,6 +109,7 @@ class EnteredData:
         self.query_data = None
         self.file_in = None
         self.query_results = None
+        self.query_summary = None
         self.save_file = None
 
 
@@ -24,12 +117,20 @@ class App(Tk):
     label_options = {
         "gene": "Enter a gene(s) to search or select a file",
         "rsid": "Enter an rsID(s) to search or select a file",
-        "allele": "Allele search is not yet supported",
+        "region": "Enter a region(s) to search or select a BED file",
+        "allele": "Enter an allele(s) to search or select a file",
+        "panel": "Enter a panel name, a tab and an ID on each line\n"
+        "or select a panel file or folder",
+        "summary": "Enter a gene(s) to summarize or select a file\n"
+        "Leave empty to summarize every gene",
     }
     entry_options = {
         "gene": "Ex:\nCYP2D6\nCYP2C9\nor\nCYP2D6,CYP2C9",
         "rsid": "Ex:\nrs1234\nrs5678\nor\nrs1234,rs5678",
-        "allele": "Allele search is not yet supported",
+        "region": "Ex:\nchr22:42126000-42131000\nchr10:94760000-94860000",
+        "allele": "Ex:\nCYP2C19*2\nCYP2D6*4\nor\nCYP2C19*2,CYP2D6*4",
+        "panel": "Ex:\ncore\tCYP2D6\ncore\trs4244285\nstatins\tSLCO1B1",
+        "summary": "Ex:\nCYP2D6\nCYP2C9\nor\nCYP2D6,CYP2C9",
     }
     default_search = "gene"
 
@@ -59,18 +160,21 @@ class App(Tk):
         self.label_radiobuttons.grid(row=0, column=0)
 
         self.option_selected = StringVar(None, "gene")
-        button_labels = {"By Gene": "gene", "By rsID": "rsid", "By Allele": "allele"}
+        button_labels = {
+            "By Gene": "gene",
+            "By rsID": "rsid",
+            "By Region": "region",
+            "By Allele": "allele",
+            "By Panel": "panel",
+            "Gene Summary": "summary",
+        }
         for i, (text, value) in enumerate(button_labels.items(), 1):
-            font_ = font.Font()
-            if value == "allele":
-                font_ = font.Font(overstrike=1)
             radiobutton = Radiobutton(
                 self.frame_radio_buttons,
                 text=text,
                 variable=self.option_selected,
                 value=value,
                 command=self.query_option_selected,
-                font=font_,
             )
             radiobutton.grid(row=i, column=0, sticky="w")
 
@@ -95,6 +199,14 @@ class App(Tk):
         )
         self.text_scroll_entry.grid(row=0, column=1, sticky="nsew")
         self.text_entry["yscrollcommand"] = self.text_scroll_entry.set
+        self.text_entry.bind("<KeyRelease>", self.update_completions)
+        self.text_entry.bind("<Tab>", self.accept_completion)
+        self.text_entry.bind("<Escape>", lambda event: self.hide_completions())
+        self.list_completions = Listbox(self.frame_text_entry, width=20, height=5)
+        self.list_completions.grid(row=1, column=0)
+        self.list_completions.grid_remove()
+        self.list_completions.bind("<<ListboxSelect>>", self.completion_selected)
+        self.completions_ready = False
 
         self.frame_text_browse = Frame(self)
         self.frame_text_browse.grid(row=2, column=1)
@@ -104,8 +216,22 @@ class App(Tk):
             command=self.select_file_open,
         )
         self.file_button_entry.grid(row=0, column=0)
+        self.button_vcf = Button(
+            self.frame_text_browse,
+            text="Annotate VCF",
+            command=self.select_vcf,
+        )
+        self.button_vcf.grid(row=0, column=1)
+        # Panels can also be read from a folder with a file per panel
+        self.folder_button_entry = Button(
+            self.frame_text_browse,
+            text="Browse Folders",
+            command=self.select_folder_open,
+        )
+        self.folder_button_entry.grid(row=0, column=2)
+        self.folder_button_entry.grid_remove()
         self.label_entry_info = Label(self.frame_text_browse, text="")
-        self.label_entry_info.grid(row=1, column=0)
+        self.label_entry_info.grid(row=1, column=0, columnspan=3)
 
         #####Submit label and  button#####
         self.frame_submit = Frame(self)
@@ -117,6 +243,24 @@ class App(Tk):
             self.frame_submit, text="Submit Query", command=self.submit
         )
         self.button_submit.grid(row=1, column=0)
+        self.button_cancel = Button(
+            self.frame_submit, text="Cancel", command=self.cancel_query
+        )
+        self.button_cancel.grid(row=1, column=1)
+        self.button_cancel.grid_remove()
+        self.progress_bar = ttk.Progressbar(
+            self.frame_submit, mode="indeterminate", length=150
+        )
+        self.progress_bar.grid(row=2, column=0, columnspan=2)
+        self.progress_bar.grid_remove()
+        self.label_status = Label(self.frame_submit, text="")
+        self.label_status.grid(row=3, column=0, columnspan=2)
+        self.profile_next = BooleanVar(self, False)
+        self.check_profile = Checkbutton(
+            self.frame_submit, text="Profile next query", variable=self.profile_next
+        )
+        self.check_profile.grid(row=4, column=0, columnspan=2)
+        self.query_task = None
 
         #####table label######
         self.frame_table_label = Frame(self)
@@ -128,15 +272,9 @@ class App(Tk):
         self.frame_table = Frame(self)
         self.frame_table.grid(row=5, column=0, columnspan=2)
 
-        self.data_table = ttk.Treeview(self.frame_table)
+        self.data_table = ResultTable(self.frame_table)
         self.data_table.grid(row=0, column=0)
         self.data_table.grid_remove()
-        self.table_scroll = ttk.Scrollbar(
-            self.frame_table, command=self.data_table.yview
-        )
-        self.table_scroll.grid(row=0, column=1, sticky="nsew")
-        self.data_table["yscrollcommand"] = self.table_scroll.set
-        self.table_scroll.grid_remove()
 
         # # #####export button#####
         self.file_button_export = Button(
@@ -147,6 +285,91 @@ class App(Tk):
         self.label_export = Label(self.frame_table, text="")
         self.label_export.grid(row=3, column=0)
 
+        # The window is shown straight away and pandas and the table are
+        # loaded in the background. Queries can't be run until that is done
+        self.button_submit.configure(state=DISABLED)
+        self.file_button_entry.configure(state=DISABLED)
+        self.button_vcf.configure(state=DISABLED)
+        self.progress_bar.grid()
+        self.progress_bar.start()
+        library_task = BackgroundTask(
+            self,
+            load_library,
+            on_done=self.library_loaded,
+            on_error=self.library_failed,
+            on_status=self.status_label_update,
+        )
+        library_task.start()
+
+    def library_loaded(self, table_loaded):
+        self.progress_bar.stop()
+        self.progress_bar.grid_remove()
+        self.button_submit.configure(state=NORMAL)
+        self.file_button_entry.configure(state=NORMAL)
+        self.button_vcf.configure(state=NORMAL)
+        self.completions_ready = table_loaded
+        self.status_label_update("")
+
+    def library_failed(self, ex):
+        self.progress_bar.stop()
+        self.progress_bar.grid_remove()
+        self.status_label_update("")
+        self.error_label_update(f"Unable to load library: {ex}")
+
+    def current_token(self):
+        # The ID being typed, from the last comma or space up to the cursor
+        line = self.text_entry.get("insert linestart", "insert")
+        return line.replace(",", " ").split(" ")[-1]
+
+    def update_completions(self, event):
+        if event.keysym in ["Tab", "Escape"]:
+            return
+        if not self.completions_ready:
+            return
+        table = app_utils.get_store().loaded()
+        option = self.entered_data.option_selected
+        token = self.current_token()
+        if table is None or option in ["region", "panel"] or len(token) < 2:
+            self.hide_completions()
+            return
+        if option == "allele":
+            try:
+                names = app_utils.allele_store.get(table).names
+            except Exception:
+                self.hide_completions()
+                return
+        else:
+            names = table.rsid_names if option == "rsid" else table.gene_names
+        completions = names.complete(token, limit=10)
+        if len(completions) == 0 or completions == [token]:
+            self.hide_completions()
+            return
+        self.list_completions.delete(0, END)
+        self.list_completions.insert(END, *completions)
+        self.list_completions.grid()
+
+    def hide_completions(self):
+        self.list_completions.delete(0, END)
+        self.list_completions.grid_remove()
+
+    def insert_completion(self, completion):
+        token = self.current_token()
+        self.text_entry.delete(f"insert-{len(token)}c", "insert")
+        self.text_entry.insert("insert", completion)
+        self.hide_completions()
+        self.text_entry.focus_set()
+
+    def accept_completion(self, event):
+        if self.list_completions.size() == 0:
+            return None
+        self.insert_completion(self.list_completions.get(0))
+        return "break"
+
+    def completion_selected(self, event):
+        selection = self.list_completions.curselection()
+        if len(selection) != 0:
+            self.insert_completion(self.list_completions.get(selection[0]))
+
     @staticmethod
     def select_all(event):
         event.widget.tag_add(SEL, "1.0", END)
@@ -160,66 +383,159 @@ class App(Tk):
             self.file_button_entry.configure(text="Browse Files")
             self.entered_data.file_in = None
             return
-        text = create_pretty_filename(file_path)
+        text = app_utils.create_pretty_filename(file_path)
         self.file_button_entry.configure(text=text)
+        self.folder_button_entry.configure(text="Browse Folders")
         self.entered_data.file_in = file_path
 
+    def select_folder_open(self):
+        folder_path = filedialog.askdirectory(title="Select a Folder of Panels")
+        if isinstance(folder_path, tuple) or folder_path == "":
+            self.folder_button_entry.configure(text="Browse Folders")
+            self.entered_data.file_in = None
+            return
+        text = os.path.basename(os.path.normpath(folder_path))
+        self.folder_button_entry.configure(text=text)
+        self.file_button_entry.configure(text="Browse Files")
+        self.entered_data.file_in = folder_path
+
     def select_file_save(self):
         file_path = filedialog.asksaveasfilename(title="Select a file name for export")
         if file_path is None or file_path == "":
             # asksaveasfile return `None` if dialog closed with "cancel".
             if self.entered_data.save_file is not None:
-                text = create_pretty_filename(self.entered_data.save_file)
+                text = app_utils.create_pretty_filename(
+                    self.entered_data.save_file
+                )
                 self.file_button_export.configure(text=text)
             return
-        text = create_pretty_filename(file_path, save=True)
+        text = app_utils.create_pretty_filename(file_path, save=True)
         if text.endswith("xls"):
             text = text.replace("xls", "xlsx")
         self.entered_data.save_file = file_path
-        error = export_data(
-            self.entered_data.query_results, self.entered_data.save_file
+        self.file_button_export.configure(text=text)
+        self.label_export.configure(text="")
+        export_task = BackgroundTask(
+            self,
+            self.run_export,
+            on_done=self.export_finished,
+            on_error=self.export_failed,
+            on_status=self.export_progress,
+        )
+        self.export_started()
+        export_task.start(
+            self.entered_data.query_results, file_path, self.entered_data.query_summary
         )
+
+    @staticmethod
+    def run_export(task, df, file_path, summary):
+        # Runs on the worker thread so progress is passed back with task.report
+        stats = QueryStats("export", file=file_path)
+        with stats.stage("export", rows_in=df.shape[0]) as record:
+            error = app_utils.export_data(
+                df,
+                file_path,
+                progress=lambda done, total: task.report((done, total)),
+                summary=summary,
+            )
+            record["rows_out"] = df.shape[0]
+        return error, stats
+
+    def export_started(self):
+        self.button_submit.configure(state=DISABLED)
+        self.file_button_export.configure(state=DISABLED)
+        self.progress_bar.configure(mode="determinate", maximum=100, value=0)
+        self.progress_bar.grid()
+
+    def export_stopped(self, status=""):
+        self.file_button_export.configure(state=NORMAL)
+        if self.query_task is not None:
+            # A query started since keeps Submit and the progress bar
+            return
+        self.progress_bar.grid_remove()
+        self.progress_bar.configure(mode="indeterminate", value=0)
+        self.button_submit.configure(state=NORMAL)
+        self.status_label_update(status)
+
+    def export_progress(self, progress):
+        done, total = progress
+        if total != 0:
+            self.progress_bar.configure(value=100 * done / total)
+        self.status_label_update(f"Exported {done} of {total} rows...")
+
+    def export_failed(self, ex):
+        self.export_stopped()
+        self.error_label_update(f"Export failed: {ex}")
+
+    def export_finished(self, result):
+        error, stats = result
+        stats.finish()
+        self.export_stopped(stats.summary())
         if error == PermissionError:
             self.error_label_update("Unable to save output. Permission Denied")
+            return
         elif error == FileNotFoundError:
             self.error_label_update("Directory for output file does not exist")
-        self.file_button_export.configure(text=text)
+            return
+        elif error is not None:
+            self.error_label_update(f"Unable to save output: {error.__name__}")
+            return
         self.label_export.configure(text="Data exported Succesfully")
 
-    def reset_table(self):
-        # Couldn't figure out any other way of doing this other than
-        # destroying the entire table widget and recreating it
-        self.data_table.destroy()
-        self.data_table = ttk.Treeview(self.frame_table)
-        self.data_table.grid(row=0, column=0)
-        self.table_scroll.destroy()
-        self.table_scroll = ttk.Scrollbar(
-            self.frame_table, command=self.data_table.yview
+    def select_vcf(self):
+        file_in = filedialog.askopenfilename(
+            title="Select a VCF to annotate",
+            filetypes=[("VCF files", "*.vcf *.vcf.gz *.vcf.bgz"), ("All files", "*")],
+        )
+        if isinstance(file_in, tuple) or file_in == "":
+            return
+        file_out = filedialog.asksaveasfilename(
+            title="Save the annotated VCF, or a tsv by ending the name in .tsv"
+        )
+        if file_out is None or file_out == "":
+            return
+        self.reset_data()
+        self.query_task = BackgroundTask(
+            self,
+            self.run_vcf_annotation,
+            on_done=self.vcf_annotation_finished,
+            on_error=self.query_failed,
+            on_status=self.status_label_update,
+        )
+        self.query_started()
+        self.query_task.start(file_in, file_out)
+
+    @staticmethod
+    def run_vcf_annotation(task, file_in, file_out):
+        # Runs on the worker thread. Stops at the next progress update when
+        # the task is cancelled
+        import vcf_annotate
+
+        stats = QueryStats("vcf", file=file_in)
+        task.report("Annotating VCF...")
+        with stats.stage("annotate_vcf") as record:
+            records, on_array = vcf_annotate.annotate_vcf(
+                file_in,
+                file_out,
+                progress=lambda records: task.report(f"Annotated {records} records..."),
+                cancelled=lambda: task.cancelled,
+            )
+            record["rows_in"] = records
+            record["rows_out"] = on_array
+        return records, on_array, stats
+
+    def vcf_annotation_finished(self, result):
+        records, on_array, stats = result
+        stats.finish()
+        self.query_stopped(stats.summary())
+        self.label_entry_info.configure(
+            text=f"{on_array} of {records} VCF records are on the array"
         )
-        self.table_scroll.grid(row=0, column=1, sticky="nsew")
-        self.data_table["yscrollcommand"] = self.table_scroll.set
 
     def build_table(self, df):
-        self.reset_table()
-        self.label_table.configure(text="Query Results")
+        self.label_table.configure(text=f"Query Results ({df.shape[0]} rows)")
         self.data_table.grid()
-        self.data_table.configure(columns=df.columns.tolist())
-        self.table_scroll.grid()
-
-        self.data_table.column("#0", width=0, stretch=NO)
-        self.data_table.heading("#0", text="", anchor=CENTER)
-
-        for column in df.columns:
-            width = 100
-            if column == "Ref" or column == "Alt":
-                width = 40
-            self.data_table.column(column, anchor=CENTER, width=width, stretch=NO)
-            self.data_table.heading(column, text=column, anchor=CENTER)
-        for iid, row_data in df.iterrows():
-            values = row_data.values.tolist()
-            self.data_table.insert(
-                parent="", index="end", iid=iid, text="", values=values
-            )
+        self.data_table.show(df)
 
     def error_label_update(self, text):
         self.label_error.configure(text=text)
@@ -237,14 +553,20 @@ class App(Tk):
 
     def submit(self):
         self.reset_data()
+        stats = QueryStats("query", data_type=self.entered_data.option_selected)
         text_entered = self.text_entry.get("1.0", END)
-        if self.entered_data.option_selected == "gene":
-            parsed_data = parse_gene_text(text_entered)
-        elif self.entered_data.option_selected == "rsid":
-            parsed_data = parse_rsid_text(text_entered)
-        elif self.entered_data.option_selected == "allele":
-            self.reset_entered_data()
-            return
+        with stats.stage("parse_text") as record:
+            if self.entered_data.option_selected in ["gene", "summary"]:
+                parsed_data = app_utils.parse_gene_text(text_entered)
+            elif self.entered_data.option_selected == "rsid":
+                parsed_data = app_utils.parse_rsid_text(text_entered)
+            elif self.entered_data.option_selected == "region":
+                parsed_data = app_utils.parse_region_text(text_entered)
+            elif self.entered_data.option_selected == "allele":
+                parsed_data = app_utils.parse_allele_text(text_entered)
+            elif self.entered_data.option_selected == "panel":
+                parsed_data = app_utils.parse_panel_text(text_entered)
+            record["rows_out"] = 0 if parsed_data is None else len(parsed_data)
         if parsed_data is not None:
             self.entered_data.query_data = parsed_data
 
@@ -252,46 +574,192 @@ class App(Tk):
             self.error_label_update("Can only accept one of text entry or file")
             return
 
-        if self.entered_data.file_in:
-            data_type = self.entered_data.option_selected
-            parsed_data, error = read_file(
-                self.entered_data.file_in, data_type=data_type
-            )
-            if error == PermissionError:
-                self.error_label_update("Permission denied when accessing file")
-                self.reset_entered_data()
-                return
-            elif error == FileNotFoundError:
-                self.error_label_update("Unable to find file")
-                self.reset_entered_data()
-                return
-            elif error == UnicodeDecodeError:
-                self.error_label_update("Unable to handle binary files")
-                self.reset_entered_data()
-                return
-            if parsed_data is not None:
-                self.entered_data.query_data = parsed_data
-        if self.entered_data.query_data is None:
+        if self.profile_next.get():
+            # Only the query itself is profiled since cProfile follows the
+            # worker thread it is started on
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            stats.profile_path = os.path.abspath(f"pscan_query_{timestamp}.prof")
+            self.profile_next.set(False)
+        self.query_task = BackgroundTask(
+            self,
+            self.run_query,
+            on_done=self.query_finished,
+            on_error=self.query_failed,
+            on_status=self.status_label_update,
+        )
+        self.query_started()
+        self.query_task.start(
+            stats,
+            self.entered_data.option_selected,
+            self.entered_data.file_in,
+            self.entered_data.query_data,
+        )
+
+    @staticmethod
+    def run_query(task, stats, data_type, file_in, query_data):
+        # Runs on the worker thread so it must not touch any widgets. Once
+        # the task is cancelled the query stops at its next check with
+        # app_utils.QueryCancelled, which the task drops like any result
+        error = None
+        report = None
+        summary = None
+        with stats.profiling():
+            if file_in:
+                task.report("Reading file...")
+                report = app_utils.ParseReport()
+                if data_type == "panel":
+                    read = app_utils.read_panels
+                elif data_type == "summary":
+                    read = partial(app_utils.read_file, data_type="gene")
+                else:
+                    read = partial(app_utils.read_file, data_type=data_type)
+                with stats.stage("read_file") as record:
+                    parsed_data, error = read(file_in, report=report)
+                    record["rows_out"] = report.count
+                if parsed_data is not None:
+                    query_data = parsed_data
+            elif data_type == "summary" and query_data is None:
+                # Every gene is summarized when none are given
+                query_data = []
+            if error is not None or query_data is None or task.cancelled:
+                return query_data, None, summary, error, report, stats, {}
+            if data_type == "summary":
+                task.report("Summarizing genes...")
+            else:
+                task.report(f"Querying {len(query_data)} {data_type}...")
+            if data_type == "panel":
+                query_results, summary = app_utils.query_panels(
+                    query_data, stats=stats, cancelled=lambda: task.cancelled
+                )
+            elif data_type == "summary":
+                query_results = app_utils.query_gene_summary(
+                    query_data or None, stats=stats
+                )
+            else:
+                query_results = app_utils.query_table(
+                    query_data, data_type, stats=stats, cancelled=lambda: task.cancelled
+                )
+            if task.cancelled:
+                return query_data, None, summary, error, report, stats, {}
+            suggestions = {}
+            suggest = {
+                "gene": app_utils.suggest_genes,
+                "summary": app_utils.suggest_genes,
+                "allele": app_utils.suggest_alleles,
+            }.get(data_type)
+            if suggest is not None:
+                with stats.stage("suggest", rows_in=len(query_data)) as record:
+                    suggestions = suggest(query_data)
+                    record["rows_out"] = len(suggestions)
+        return query_data, query_results, summary, error, report, stats, suggestions
+
+    def query_started(self):
+        self.button_submit.configure(state=DISABLED)
+        self.button_vcf.configure(state=DISABLED)
+        # Exports share the progress bar and re-enable Submit when done
+        self.file_button_export.configure(state=DISABLED)
+        self.button_cancel.grid()
+        self.progress_bar.grid()
+        self.progress_bar.start()
+
+    def query_stopped(self, status=""):
+        self.progress_bar.stop()
+        self.progress_bar.grid_remove()
+        self.button_cancel.grid_remove()
+        self.button_submit.configure(state=NORMAL)
+        self.button_vcf.configure(state=NORMAL)
+        self.file_button_export.configure(state=NORMAL)
+        self.status_label_update(status)
+        self.query_task = None
+
+    def cancel_query(self):
+        if self.query_task is not None:
+            self.query_task.cancel()
+        self.reset_entered_data()
+        self.query_stopped("Query cancelled")
+
+    def query_failed(self, ex):
+        self.reset_entered_data()
+        self.query_stopped()
+        self.error_label_update(f"Query failed: {ex}")
+
+    def query_finished(self, result):
+        (
+            query_data,
+            query_results,
+            summary,
+            error,
+            report,
+            stats,
+            suggestions,
+        ) = result
+        self.query_stopped()
+        if error == PermissionError:
+            self.error_label_update("Permission denied when accessing file")
+            self.reset_entered_data()
+            return
+        elif error == FileNotFoundError:
+            self.error_label_update("Unable to find file")
+            self.reset_entered_data()
+            return
+        elif error == UnicodeDecodeError:
+            self.error_label_update("Unable to handle binary files")
+            self.reset_entered_data()
+            return
+        if query_data is None:
             self.error_label_update("Must supply one of text entry or file")
             return
+        self.entered_data.query_data = query_data
         text = f"Parsed out {len(self.entered_data.query_data)} {self.entered_data.option_selected}"
+        if len(query_data) == 0:
+            text = f"Summarized all {query_results.shape[0]} genes"
+        if report is not None and report.malformed_count != 0:
+            text += f"\nSkipped {report.malformed_count} malformed entries"
+        for id_, similar in list(suggestions.items())[:5]:
+            text += f"\n{id_} not found"
+            if len(similar) != 0:
+                text += f", did you mean {' or '.join(similar)}?"
+        if len(suggestions) > 5:
+            text += f"\n{len(suggestions) - 5} more not found"
+        if summary is not None:
+            for row in summary.head(5).itertuples(index=False):
+                text += f"\n{row[0]}: {row[2]} of {row[1]} on the array"
+            if summary.shape[0] > 5:
+                text += f"\n{summary.shape[0] - 5} more panels"
         self.label_entry_info.configure(text=text)
 
-        query_results = query_table(self.entered_data.query_data)
         self.entered_data.query_results = query_results
-        self.build_table(self.entered_data.query_results)
+        self.entered_data.query_summary = summary
+        with stats.stage("render", rows_in=query_results.shape[0]) as record:
+            self.build_table(self.entered_data.query_results)
+            self.update_idletasks()
+            record["rows_out"] = len(self.data_table.tree.get_children())
         self.file_button_export.grid()
+        stats.finish()
+        status = stats.summary()
+        if stats.profile_path is not None:
+            status += f"\nProfile written to {stats.profile_path}"
+        self.status_label_update(status)
+
+    def status_label_update(self, text):
+        self.label_status.configure(text=text)
 
     def query_option_selected(self):
         self.entered_data.option_selected = self.option_selected.get()
         text_label_option = self.label_options[self.entered_data.option_selected]
         self.label_entry.configure(text=text_label_option)
 
+        self.hide_completions()
         self.text_entry.delete("1.0", END)
         text_entry_option = self.entry_options[self.entered_data.option_selected]
         self.text_entry.insert(INSERT, text_entry_option)
 
         self.file_button_entry.configure(text="Browse Files")
+        self.folder_button_entry.configure(text="Browse Folders")
+        if self.entered_data.option_selected == "panel":
+            self.folder_button_entry.grid()
+        else:
+            self.folder_button_entry.grid_remove()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,29 @@
+import atexit
+import bisect
 import csv
+import gzip
+import json
 import os
+import pickle
+import queue
 import re
+import sqlite3
 import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+from instrumentation import NullStats
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
 
 def parse_gene_text(text_entered):
     text_entered = text_entered.split("\n")
@@ -27,42 +45,173 @@ def parse_rsid_text(text_entered):
     return [rsid.lower() for rsid in rsids]
 
 
-def _parse_gene_file(file_path):
-    file_contents = None
-    error = None
-    genes = []
-    try:
-        with open(file_path, "r") as f:
-            csv_reader = csv.reader(f)
-            for line in csv_reader:
-                for gene in line:
-                    genes.append(gene.strip().upper())
-    except Exception:
-        ex_type, *_ = sys.exc_info()
-        error = ex_type
-        return file_contents, error
-    if len(genes) != 0:
-        file_contents = genes
-    return file_contents, error
+def normalize_chromosome(chromosome):
+    chromosome = str(chromosome).strip().upper()
+    if chromosome.startswith("CHR"):
+        chromosome = chromosome[3:]
+    if chromosome == "M":
+        chromosome = "MT"
+    return chromosome
+
+
+def _format_region(chromosome, start, end):
+    return f"{normalize_chromosome(chromosome)}:{start}-{end}"
+
+
+# A position, optionally with thousands separators like 42,126,000. A comma
+# group followed by : is the start of the next comma separated region
+_region_position = r"(\d+(?:,\d{3}(?![\d:]))*)"
+_region_pattern = re.compile(rf"(\w+):{_region_position}-{_region_position}")
+
+
+def parse_region_text(text_entered):
+    # Regions are entered as chr:start-end using 1-based inclusive positions
+    regions = [
+        _format_region(chromosome, start.replace(",", ""), end.replace(",", ""))
+        for chromosome, start, end in _region_pattern.findall(text_entered)
+    ]
+    if len(regions) == 0:
+        return None
+    return regions
+
+
+def _normalize_allele(allele):
+    # CYP2C19*2, cyp2c19 * 2 and CYP2C19  *2 are all the same allele
+    allele = re.sub(r"\s*\*\s*", "*", allele.strip().upper())
+    return re.sub(r"\s+", " ", allele)
+
+
+def parse_allele_text(text_entered):
+    # Alleles are named like CYP2C19*2 or HLA-B*57:01
+    alleles = []
+    for line in text_entered.split("\n"):
+        for allele in line.split(","):
+            allele = _normalize_allele(allele)
+            if len(allele) != 0:
+                alleles.append(allele)
+    if len(alleles) == 0:
+        return None
+    return alleles
+
+
+class ParseReport:
+    """Running counts kept while IDs are parsed out of an input.
+
+    count is the number of unique IDs found. Only the first few malformed
+    tokens are kept as examples so the report stays small for any input.
+    """
+
+    max_examples = 10
+
+    def __init__(self):
+        self.count = 0
+        self.duplicates = 0
+        self.malformed_count = 0
+        self.malformed = []
+
+    def add_malformed(self, token):
+        self.malformed_count += 1
+        if len(self.malformed) < self.max_examples:
+            self.malformed.append(token)
+
+    def summary(self):
+        text = f"{self.count} unique"
+        if self.duplicates != 0:
+            text += f", {self.duplicates} duplicates"
+        if self.malformed_count != 0:
+            examples = ", ".join(self.malformed)
+            text += f", {self.malformed_count} malformed (e.g. {examples})"
+        return text
+
+
+def _iter_gene_lines(lines, report):
+    for line in csv.reader(lines):
+        for gene in line:
+            gene = gene.strip().upper()
+            if len(gene) == 0:
+                continue
+            if re.fullmatch(r"[A-Z0-9][A-Z0-9_.@/-]*", gene):
+                yield gene
+            else:
+                report.add_malformed(gene)
+
+
+def _iter_rsid_lines(lines, report):
+    for line in lines:
+        for token in re.split(r"[\s,;]+", line):
+            rsids = re.findall(r"rs\d+", token, flags=re.IGNORECASE)
+            if len(rsids) == 0 and len(token) != 0:
+                report.add_malformed(token)
+            for rsid in rsids:
+                yield rsid.lower()
+
+
+def _iter_region_lines(lines, report):
+    # Accepts either a BED file or a file of chr:start-end regions
+    for line in lines:
+        if line.startswith(("#", "track", "browser")) or len(line.strip()) == 0:
+            continue
+        fields = line.split()
+        if len(fields) >= 3 and fields[1].isdigit() and fields[2].isdigit():
+            # BED positions are 0-based and half open
+            start = int(fields[1]) + 1
+            yield _format_region(fields[0], start, fields[2])
+            continue
+        regions = parse_region_text(line)
+        if regions is None:
+            report.add_malformed(line.strip())
+            continue
+        yield from regions
+
+
+def _iter_allele_lines(lines, report):
+    for line in csv.reader(lines):
+        for allele in line:
+            allele = _normalize_allele(allele)
+            if len(allele) != 0:
+                yield allele
+
+
+_line_parsers = {
+    "gene": _iter_gene_lines,
+    "rsid": _iter_rsid_lines,
+    "region": _iter_region_lines,
+    "allele": _iter_allele_lines,
+}
+
 
+def iter_ids(lines, data_type, report=None):
+    # Lazily parses IDs out of any iterable of lines such as an open file so
+    # that large inputs are never held in memory all at once. Each ID is only
+    # yielded the first time it is seen.
+    if report is None:
+        report = ParseReport()
+    seen = set()
+    for id_ in _line_parsers[data_type](lines, report):
+        if id_ in seen:
+            report.duplicates += 1
+            continue
+        seen.add(id_)
+        report.count += 1
+        yield id_
 
-def _parse_rsid_file(file_path):
+
+def _parse_file(file_path, data_type, report):
     file_contents = None
     error = None
     try:
         with open(file_path, "r") as f:
-            lines = f.readlines()
+            ids = list(iter_ids(f, data_type, report))
     except Exception:
         ex_type, *_ = sys.exc_info()
         error = ex_type
         return file_contents, error
-    rsids = parse_rsid_text(str(lines))
-    if len(rsids) != 0:
-        file_contents = rsids
+    if len(ids) != 0:
+        file_contents = ids
     return file_contents, error
 
 
-def read_file(file_path, data_type=None):
+def read_file(file_path, data_type=None, report=None):
     file_contents = None
     error = None
     if file_path is None:
@@ -70,44 +219,342 @@ def read_file(file_path, data_type=None):
     if not os.path.isfile(file_path):
         error = FileNotFoundError
         return file_contents, error
-    if data_type == "gene":
-        file_contents, error = _parse_gene_file(file_path)
-    elif data_type == "rsid":
-        file_contents, error = _parse_rsid_file(file_path)
+    if data_type in _line_parsers:
+        file_contents, error = _parse_file(file_path, data_type, report)
     return file_contents, error
 
 
-def _filter_by_rsids(df, rsids):
-    filtered_table = (
-        df.loc[df["rsID"].isin(rsids)]
-        .merge(
-            pd.Series(rsids, name="rsID"),
-            how="outer",
-            on="rsID",
-            indicator=True,
-        )
-        .query("`_merge`.isin(['both', 'right_only'])")
+def _iter_panel_lines(lines, report):
+    # Yields the panel name and the IDs text of each panel<TAB>IDs line
+    for line in lines:
+        if line.startswith("#") or len(line.strip()) == 0:
+            continue
+        panel, tab, text = line.partition("\t")
+        if len(tab) == 0 or len(panel.strip()) == 0:
+            report.add_malformed(line.strip())
+            continue
+        yield panel.strip(), text
+
+
+def _collect_panels(panel_lines, report):
+    # Panels can mix genes, rsIDs, regions and alleles so each ID is typed on
+    # its own. IDs are only kept the first time they are seen in a panel
+    panels = {}
+    for panel, text in panel_lines:
+        ids = panels.setdefault(panel, {})
+        for token in re.split(r"[,\t]", text):
+            token = token.strip()
+            if len(token) == 0:
+                continue
+            data_type = find_data_type([token])
+            for id_ in _line_parsers[data_type]([token], report):
+                if (data_type, id_) in ids:
+                    report.duplicates += 1
+                    continue
+                ids[(data_type, id_)] = None
+                report.count += 1
+    return {panel: list(ids) for panel, ids in panels.items() if len(ids) != 0}
+
+
+def parse_panel_text(text_entered):
+    # Panels are entered as panel<TAB>ID lines. Returns a dict of each panel
+    # name to its (data type, ID) pairs
+    report = ParseReport()
+    panels = _collect_panels(
+        _iter_panel_lines(text_entered.split("\n"), report), report
     )
-    filtered_table["On Array"] = np.where(
-        filtered_table["_merge"] == "both", "Yes", "No"
+    if len(panels) == 0:
+        return None
+    return panels
+
+
+def _read_panels(path, report):
+    if not os.path.isdir(path):
+        with open(path, "r") as f:
+            return _collect_panels(_iter_panel_lines(f, report), report)
+    # One panel per file, named after the file
+    panel_lines = []
+    for file_name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, file_name)
+        if file_name.startswith(".") or not os.path.isfile(file_path):
+            continue
+        panel = os.path.splitext(file_name)[0]
+        with open(file_path, "r") as f:
+            panel_lines.extend(
+                (panel, line) for line in f if not line.startswith("#")
+            )
+    return _collect_panels(panel_lines, report)
+
+
+def read_panels(path, report=None):
+    """Reads panels from a panel<TAB>ID file or a directory of panel files.
+
+    Returns the panels like parse_panel_text along with the error type, if
+    any, the same way read_file does.
+    """
+    if report is None:
+        report = ParseReport()
+    if path is None:
+        return None, None
+    if not os.path.exists(path):
+        return None, FileNotFoundError
+    try:
+        panels = _read_panels(path, report)
+    except Exception:
+        ex_type, *_ = sys.exc_info()
+        return None, ex_type
+    if len(panels) == 0:
+        return None, None
+    return panels, None
+
+
+def _build_index(column):
+    # Maps each value in the column to the row offsets it appears at.
+    # NaNs are left out since they can never be queried for
+    return column.groupby(column, sort=False).indices
+
+
+def _edit_distances(word, candidates):
+    # Edit distances from word to every row of candidates, an (n, length)
+    # array of character codes, counting swapped neighbouring characters as
+    # one edit. Each cell of the usual dynamic programming table is worked
+    # out for all candidates at once
+    count, length = candidates.shape
+    previous2 = None
+    previous = np.tile(np.arange(length + 1), (count, 1))
+    for i in range(1, len(word) + 1):
+        current = np.empty_like(previous)
+        current[:, 0] = i
+        for j in range(1, length + 1):
+            cost = candidates[:, j - 1] != word[i - 1]
+            current[:, j] = np.minimum(
+                np.minimum(previous[:, j], current[:, j - 1]) + 1,
+                previous[:, j - 1] + cost,
+            )
+            if previous2 is not None and j > 1:
+                swapped = (candidates[:, j - 2] == word[i - 1]) & (
+                    candidates[:, j - 1] == word[i - 2]
+                )
+                current[swapped, j] = np.minimum(
+                    current[swapped, j], previous2[swapped, j - 2] + 1
+                )
+        previous2, previous = previous, current
+    return previous[:, -1]
+
+
+def _char_codes(strings, length):
+    codes = [[ord(c) for c in string] for string in strings]
+    return np.array(codes, dtype=np.uint32).reshape(len(strings), length)
+
+
+class SymbolIndex:
+    """Sorted distinct symbols for completing prefixes and suggesting spellings.
+
+    Lookups ignore case. Prefix lookups are a binary search into the sorted
+    symbols so take the same time however large the table is. Suggestions
+    only compare against symbols close enough in length to be within the
+    allowed edit distance.
+    """
+
+    def __init__(self, symbols):
+        self.names = sorted({str(symbol) for symbol in symbols}, key=str.upper)
+        self.keys = [name.upper() for name in self.names]
+        self._by_length = None
+
+    def _group_by_length(self):
+        # Symbols of each length as arrays of character codes for suggest().
+        # Only built the first time suggestions are asked for
+        by_length = {}
+        for i, key in enumerate(self.keys):
+            by_length.setdefault(len(key), []).append(i)
+        return {
+            length: (
+                np.array(offsets),
+                _char_codes([self.keys[i] for i in offsets], length),
+            )
+            for length, offsets in by_length.items()
+        }
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, symbol):
+        key = str(symbol).upper()
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def complete(self, prefix, limit=10):
+        prefix = prefix.upper()
+        start = bisect.bisect_left(self.keys, prefix)
+        completions = []
+        for i in range(start, min(start + limit, len(self.keys))):
+            if not self.keys[i].startswith(prefix):
+                break
+            completions.append(self.names[i])
+        return completions
+
+    def suggest(self, symbol, limit=3, max_distance=2):
+        if self._by_length is None:
+            self._by_length = self._group_by_length()
+        key = symbol.upper()
+        word = _char_codes([key], len(key))[0]
+        scored = []
+        for length in range(len(key) - max_distance, len(key) + max_distance + 1):
+            if length not in self._by_length:
+                continue
+            offsets, candidates = self._by_length[length]
+            distances = _edit_distances(word, candidates)
+            close = distances <= max_distance
+            for distance, i in zip(distances[close], offsets[close]):
+                scored.append((distance, self.keys[i], self.names[i]))
+        scored.sort()
+        return [name for _, _, name in scored[:limit]]
+
+
+def _select_rows(df, col, values, index=None):
+    # Same rows and row order as df.loc[df[col].isin(values)], but only
+    # touches the rows that were asked for when an index is available
+    if index is None:
+        return df.loc[df[col].isin(values)]
+    offsets = [index[value] for value in set(values) if value in index]
+    if len(offsets) == 0:
+        return df.iloc[[]]
+    return df.iloc[np.unique(np.concatenate(offsets))]
+
+
+def _filter_by_rsids(table, rsids, use_index=True):
+    # Rows are laid out the same way an outer merge of the table rows against
+    # the queried rsids lays them out. Table rows are grouped by rsID in order
+    # of first appearance and repeated once per time the rsID was queried.
+    # These are followed by the queried rsIDs that are not on the array.
+    # Matching is done on the integer rsID codes and only the rows found are
+    # turned back into strings
+    query = pd.Series(rsids, name="rsID")
+    query_counts = query.value_counts(sort=False)
+    found = _select_rows(
+        table.df,
+        "rsID",
+        table.rsid_codec.encode(rsids),
+        table.rsid_index if use_index else None,
     )
-    filtered_table = filtered_table.loc[
-        :, ["Gene", "rsID", "On Array"]
-    ].drop_duplicates()
+    codes, _ = pd.factorize(found["rsID"])
+    found = found.iloc[np.argsort(codes, kind="stable")]
+    found = table.decode(found.loc[:, ["Gene", "rsID"]])
+    found = found.assign(**{"On Array": "Yes"})
+    found = found.iloc[
+        np.repeat(np.arange(len(found)), query_counts[found["rsID"]].to_numpy())
+    ]
+
+    missing = query.drop_duplicates()
+    missing = missing.loc[~missing.isin(found["rsID"])]
+    missing = pd.DataFrame(
+        {"Gene": np.nan, "rsID": missing, "On Array": "No"},
+        columns=["Gene", "rsID", "On Array"],
+    )
+    missing = missing.iloc[
+        np.repeat(np.arange(len(missing)), query_counts[missing["rsID"]].to_numpy())
+    ]
+
+    filtered_table = pd.concat([found, missing], ignore_index=True)
+    filtered_table = filtered_table.drop_duplicates()
     return filtered_table
 
 
-def _filter_by_genes(df, genes):
+class RegionIndex:
+    """Per chromosome arrays of probe positions sorted for binary search.
+
+    offsets holds the table row offset for each entry in positions.
+    """
+
+    def __init__(self, df):
+        self.positions = {}
+        self.offsets = {}
+        chromosomes = df["Chromosome"]
+        if isinstance(chromosomes.dtype, pd.CategoricalDtype):
+            chromosomes = chromosomes.astype(chromosomes.cat.categories.dtype)
+        if pd.api.types.is_numeric_dtype(chromosomes):
+            # Tables with only numbered chromosomes are read in as numbers
+            chromosomes = chromosomes.astype("Int64")
+        chromosomes = chromosomes.astype(str).map(normalize_chromosome)
+        has_position = df["Position"].notna().to_numpy()
+        positions = df["Position"].to_numpy(dtype="float64", na_value=np.nan)
+        for chromosome, offsets in _build_index(chromosomes).items():
+            offsets = offsets[has_position[offsets]]
+            order = np.argsort(positions[offsets], kind="stable")
+            self.offsets[chromosome] = offsets[order]
+            self.positions[chromosome] = positions[offsets[order]].astype("int64")
+
+    def lookup(self, chromosome, start, end):
+        # Row offsets of every probe from start to end inclusive
+        positions = self.positions.get(chromosome)
+        if positions is None:
+            return np.array([], dtype="int64")
+        lo = positions.searchsorted(start, side="left")
+        hi = positions.searchsorted(end, side="right")
+        return self.offsets[chromosome][lo:hi]
+
+
+def _lookup_regions(table, regions, cancelled=None):
+    # Row offsets of the probes in each region, the region of each of those
+    # rows and the regions without any probes
+    offsets = []
+    labels = []
+    missing = []
+    for i, region in enumerate(regions):
+        if i % 10_000 == 0:
+            _check_cancelled(cancelled)
+        chromosome, span = region.rsplit(":", 1)
+        start, end = span.split("-")
+        found = table.region_index.lookup(chromosome, int(start), int(end))
+        if len(found) == 0:
+            missing.append(region)
+        offsets.append(found)
+        labels.append(np.repeat(region, len(found)))
+    if len(offsets) == 0:
+        return np.array([], dtype="int64"), np.array([], dtype=object), missing
+    offsets = np.concatenate(offsets).astype("int64")
+    return offsets, np.concatenate(labels).astype(object), missing
+
+
+def _filter_by_regions(table, regions, cancelled=None):
+    cols = ["Chromosome", "Position", "Gene", "rsID", "Ref", "Alt", "Probe Count"]
+    offsets, labels, missing = _lookup_regions(table, regions, cancelled)
+    found = table.decode(table.df.iloc[offsets].loc[:, cols])
+    found.insert(0, "Region", labels)
+    found["On Array"] = "Yes"
+    missing = pd.DataFrame(
+        {"Region": missing, "On Array": "No"}, columns=found.columns
+    )
+    # Regions with no probes stay in the position they were entered in
+    order = {region: i for i, region in enumerate(dict.fromkeys(regions))}
+    filtered_table = pd.concat([found, missing])
+    filtered_table = filtered_table.iloc[
+        np.argsort(filtered_table["Region"].map(order).to_numpy(), kind="stable")
+    ]
+    filtered_table = filtered_table.drop_duplicates(ignore_index=True).astype(
+        {"Position": "Int64", "Probe Count": "Int64"}
+    )
+    return filtered_table
+
+
+def _filter_by_genes(table, genes, use_index=True):
     cols = ["Gene", "rsID", "Position", "Ref", "Alt", "Probe Count"]
+    df = _select_rows(
+        table.df, "Gene", genes, table.gene_index if use_index else None
+    )
     df = (
-        df.loc[df["Gene"].isin(genes), cols]
+        table.decode(df.loc[:, cols])
         .drop_duplicates()
         .sort_values(["Gene", "Position"])
     )
     return df
 
 
-def _find_data_type(query_data):
+def find_data_type(query_data):
+    if re.fullmatch(r"\w+:\d+-\d+", query_data[0]):
+        return "region"
+    if "*" in query_data[0]:
+        return "allele"
     if re.search(r"rs\d+", query_data[0], flags=re.IGNORECASE):
         return "rsid"
     else:
@@ -136,39 +583,1403 @@ def _resource_path(file_name):
     return path_to_data
 
 
-def query_table(query_data):
-    # Need to parse one of the columns to int that can handle NaNs
-    file_name = "pscan_table_r9.csv"
-    table_path = _resource_path(file_name)
-    pharmacoscan_table = pd.read_csv(table_path, comment="#").astype(
-        {"Position": "Int64"}
+_numeric_rsid = re.compile(r"rs[1-9]\d{0,17}")
+
+
+class RsidCodec:
+    """Stores rsIDs as unsigned integers.
+
+    rsIDs like rs4244285 are stored as the number after rs. Any other ID is
+    given a code from other_base up and kept in a side table so it can be
+    turned back into the same string. 0 stands for a missing rsID and unknown
+    for an ID that isn't in the side table, which never matches a table row.
+    """
+
+    missing = 0
+    other_base = 2 ** 63
+    unknown = 2 ** 64 - 1
+
+    def __init__(self):
+        self.others = []
+        self.other_codes = {}
+
+    def _other_code(self, rsid, add):
+        code = self.other_codes.get(rsid)
+        if code is None:
+            if not add:
+                return self.unknown
+            code = self.other_base + len(self.others)
+            self.others.append(rsid)
+            self.other_codes[rsid] = code
+        return code
+
+    def encode_one(self, rsid):
+        if not isinstance(rsid, str):
+            return self.missing
+        if _numeric_rsid.fullmatch(rsid):
+            return int(rsid[2:])
+        return self._other_code(rsid, False)
+
+    def encode(self, rsids, add=False):
+        # add puts IDs that aren't numeric rsIDs in the side table. Queries
+        # don't add to it so unknown IDs can't grow it
+        rsids = pd.Series(np.asarray(rsids, dtype=object), dtype=object)
+        codes = np.zeros(len(rsids), dtype=np.uint64)
+        present = rsids.notna().to_numpy()
+        numeric = rsids.str.fullmatch(_numeric_rsid.pattern, na=False).to_numpy()
+        codes[numeric] = [int(rsid[2:]) for rsid in rsids.to_numpy()[numeric]]
+        others = present & ~numeric
+        if others.any():
+            codes[others] = [
+                self._other_code(rsid, add) for rsid in rsids.to_numpy()[others]
+            ]
+        return codes
+
+    def decode(self, codes):
+        codes = np.asarray(codes, dtype=np.uint64)
+        rsids = np.full(len(codes), np.nan, dtype=object)
+        numeric = (codes != self.missing) & (codes < self.other_base)
+        rsids[numeric] = ["rs" + str(code) for code in codes[numeric].tolist()]
+        others = (codes >= self.other_base) & (codes != self.unknown)
+        if others.any():
+            rsids[others] = [
+                self.others[code - self.other_base] for code in codes[others].tolist()
+            ]
+        return rsids
+
+
+def _compact_table(df, rsid_codec):
+    # Gene, Chromosome, Ref and Alt repeat a small number of values so are
+    # stored as categoricals, and rsIDs are stored as integers. Chromosomes
+    # are left alone when the table only has numbered ones. Columns that are
+    # already compact, like in the joined releases, are kept as they are
+    columns = {}
+    for col in ["Gene", "Chromosome", "Ref", "Alt"]:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            columns[col] = df[col].astype("category")
+    if df["rsID"].dtype != np.uint64:
+        columns["rsID"] = rsid_codec.encode(df["rsID"], add=True)
+    return df.assign(**columns)
+
+
+def _build_category_index(column):
+    # Same as _build_index for a categorical column, grouping on the codes
+    codes = pd.Series(column.cat.codes.to_numpy())
+    categories = column.cat.categories
+    return {
+        categories[code]: offsets
+        for code, offsets in _build_index(codes).items()
+        if code != -1
+    }
+
+
+class ProbeTable:
+    """The loaded pharmacoscan table along with the lookup indexes built on it.
+
+    The indexes map a Gene or rsID to the row offsets it appears at so a query
+    only has to touch the rows it asks for.
+
+    The table is held in a compact form, see _compact_table, and rsID lookups
+    are keyed on the integer codes from rsid_codec. decode() turns rows back
+    into strings once they have been picked out for display or export.
+    """
+
+    def __init__(self, df, fingerprint=None, rsid_codec=None):
+        self.rsid_codec = RsidCodec() if rsid_codec is None else rsid_codec
+        self.df = _compact_table(df, self.rsid_codec)
+        # Identifies the file the table was read from for the query cache
+        self.fingerprint = fingerprint
+        self.gene_index = _build_category_index(self.df["Gene"])
+        self.rsid_index = _build_index(self.df["rsID"])
+        self.rsid_index.pop(RsidCodec.missing, None)
+        self.region_index = RegionIndex(self.df)
+        self._gene_names = None
+        self._rsid_names = None
+
+    @property
+    def row_count(self):
+        return self.df.shape[0]
+
+    def has_rsids(self, rsids):
+        # Whether each rsID is in the table
+        codes = self.rsid_codec.encode(rsids)
+        return np.array(
+            [code in self.rsid_index for code in codes.tolist()], dtype=bool
+        )
+
+    def has_position(self, chromosome, position):
+        return len(self.region_index.lookup(chromosome, position, position)) != 0
+
+    def decode(self, df):
+        columns = {
+            col: df[col].astype(df[col].cat.categories.dtype)
+            for col in df.columns
+            if isinstance(df[col].dtype, pd.CategoricalDtype)
+        }
+        if "rsID" in df.columns:
+            columns["rsID"] = self.rsid_codec.decode(df["rsID"].to_numpy())
+        return df.assign(**columns)
+
+    # The symbol indexes are only needed for completions and suggestions so
+    # are built the first time they are used. The lookup index keys are
+    # already the distinct symbols in the table
+    @property
+    def gene_names(self):
+        if self._gene_names is None:
+            self._gene_names = SymbolIndex(self.gene_index.keys())
+        return self._gene_names
+
+    @property
+    def rsid_names(self):
+        if self._rsid_names is None:
+            codes = np.array(list(self.rsid_index.keys()), dtype=np.uint64)
+            self._rsid_names = SymbolIndex(self.rsid_codec.decode(codes))
+        return self._rsid_names
+
+    def build_symbol_indexes(self):
+        # Builds gene_names and rsid_names ahead of the first completion
+        return self.gene_names, self.rsid_names
+
+
+class TableStore:
+    """Process-wide holder for the pharmacoscan table.
+
+    The table is parsed once and the same in-memory frame is handed to every
+    query. It is only read again when the file's mtime or size changes, or
+    when reload() is called explicitly.
+
+    The Feather copy of the table written by create_probes_table.py is
+    memory mapped when it exists and pyarrow is installed. Otherwise the csv
+    is used. The Feather file records the size and mtime of the csv it was
+    made from, and is ignored once the csv no longer matches, e.g. after a
+    newer csv has been downloaded over it.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.binary_file_name = os.path.splitext(file_name)[0] + ".feather"
+        self._lock = threading.Lock()
+        self._table = None
+        self._signature = None
+        self._binary_checks = {}
+
+    def _binary_matches(self, binary_path, path):
+        # Whether the Feather file was made from the csv as it is now. Only
+        # checked again when either file changes
+        if not os.path.isfile(path):
+            return True
+        key = (self._file_signature(binary_path), self._file_signature(path))
+        matches = self._binary_checks.get(key)
+        if matches is None:
+            schema = feather.read_table(binary_path, memory_map=True).schema
+            source = (schema.metadata or {}).get(b"pscan_query_source")
+            stat = os.stat(path)
+            matches = source is not None and json.loads(source) == {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+            self._binary_checks = {key: matches}
+        return matches
+
+    @property
+    def path(self):
+        path = _resource_path(self.file_name)
+        if feather is not None:
+            binary_path = _resource_path(self.binary_file_name)
+            if os.path.isfile(binary_path) and self._binary_matches(
+                binary_path, path
+            ):
+                return binary_path
+        return path
+
+    @staticmethod
+    def _file_signature(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _read_table(path):
+        if path.endswith(".feather"):
+            # Dictionary encoded columns come back as categoricals, which
+            # the table is stored as anyway. to_pandas still copies every
+            # column out of the mapped file so this only saves parsing time,
+            # not memory
+            df = feather.read_table(path, memory_map=True).to_pandas()
+        else:
+            df = pd.read_csv(path, comment="#")
+        # Need to parse one of the columns to int that can handle NaNs
+        return df.astype({"Position": "Int64"})
+
+    def _load(self, path, signature):
+        fingerprint = (os.path.basename(path), *signature)
+        self._table = ProbeTable(self._read_table(path), fingerprint)
+        self._signature = signature
+
+    def get(self):
+        path = self.path
+        signature = self._file_signature(path)
+        with self._lock:
+            if self._table is None or signature != self._signature:
+                self._load(path, signature)
+            return self._table
+
+    def reload(self):
+        path = self.path
+        signature = self._file_signature(path)
+        with self._lock:
+            self._load(path, signature)
+            return self._table
+
+    def loaded(self):
+        # The table if it has already been loaded, without loading it
+        return self._table
+
+    def warm(self):
+        # Loads the table ahead of the first query if it isn't already loaded
+        self.get()
+        return self
+
+
+# Release of the table the tool queries, e.g. r9 for pscan_table_r9.csv
+table_version = os.environ.get("PSCAN_TABLE_VERSION", "r9")
+table_store = TableStore(f"pscan_table_{table_version}.csv")
+
+
+class SqliteTable:
+    """The SQLite table written by create_probes_table.py --sqlite.
+
+    Nothing but the row count is read up front. Queries run on a small pool
+    of read-only connections: the IDs are loaded into a temp table on the
+    connection and joined against the indexed probes table, so only the
+    matching rows are read. Each process only holds the rows of its results.
+    """
+
+    def __init__(self, path, fingerprint=None, pool_size=4):
+        self.path = path
+        self.fingerprint = fingerprint
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        with self.connection() as conn:
+            self.row_count = conn.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+            metadata = dict(conn.execute("SELECT key, value FROM metadata"))
+        self.header = json.loads(metadata["header"])
+        self.dtypes = json.loads(metadata["dtypes"])
+        self._gene_names = None
+        self._rsid_names = None
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            Path(self.path).as_uri() + "?mode=ro", uri=True, check_same_thread=False
+        )
+        # Otherwise SQLite may build a throwaway index over the whole table
+        # for each join instead of using the ones written with it
+        conn.execute("PRAGMA automatic_index = OFF")
+        conn.execute("CREATE TEMP TABLE query_ids (id TEXT)")
+        conn.execute(
+            "CREATE TEMP TABLE query_regions "
+            "(ord INTEGER, region TEXT, chromosome TEXT, start INTEGER, end INTEGER)"
+        )
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            # Drops the IDs loaded into the temp tables and ends the read
+            conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @staticmethod
+    def load_ids(conn, ids):
+        conn.execute("DELETE FROM temp.query_ids")
+        conn.executemany(
+            "INSERT INTO temp.query_ids VALUES (?)",
+            [(id_,) for id_ in dict.fromkeys(ids) if isinstance(id_, str)],
+        )
+
+    def read(self, conn, sql, columns):
+        # Rows of a query as a DataFrame with the same types the csv is read
+        # in as. NULLs come back as None so are swapped for NaN
+        df = pd.DataFrame.from_records(conn.execute(sql).fetchall(), columns=columns)
+        return df.fillna(np.nan).astype(
+            {col: dtype for col, dtype in self.dtypes.items() if col in columns}
+        )
+
+    def _distinct(self, col):
+        with self.connection() as conn:
+            rows = conn.execute(
+                f'SELECT DISTINCT "{col}" FROM probes WHERE "{col}" IS NOT NULL'
+            )
+            return [row[0] for row in rows]
+
+    @property
+    def gene_names(self):
+        if self._gene_names is None:
+            self._gene_names = SymbolIndex(self._distinct("Gene"))
+        return self._gene_names
+
+    @property
+    def rsid_names(self):
+        if self._rsid_names is None:
+            self._rsid_names = SymbolIndex(self._distinct("rsID"))
+        return self._rsid_names
+
+    def build_symbol_indexes(self):
+        # Builds gene_names and rsid_names ahead of the first completion
+        return self.gene_names, self.rsid_names
+
+    def has_rsids(self, rsids):
+        rsids = list(rsids)
+        with self.connection() as conn:
+            self.load_ids(conn, rsids)
+            found = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT DISTINCT p.rsID FROM temp.query_ids AS q "
+                    "CROSS JOIN probes AS p ON p.rsID = q.id"
+                )
+            }
+        return np.array([rsid in found for rsid in rsids], dtype=bool)
+
+    def has_position(self, chromosome, position):
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM probes WHERE chromosome_key = ? AND Position = ? "
+                "LIMIT 1",
+                (chromosome, position),
+            ).fetchone()
+        return row is not None
+
+
+class SqliteStore(TableStore):
+    """Holder for the SQLite table. Reopened when the file changes."""
+
+    @property
+    def path(self):
+        return _resource_path(self.file_name)
+
+    def _load(self, path, signature):
+        fingerprint = (os.path.basename(path), *signature)
+        self._table = SqliteTable(path, fingerprint)
+        self._signature = signature
+
+
+sqlite_store = SqliteStore(f"pscan_table_{table_version}.sqlite")
+# "pandas" answers queries from the table held in memory and "sqlite" from
+# the database written by create_probes_table.py --sqlite
+query_engine = os.environ.get("PSCAN_QUERY_ENGINE", "pandas")
+
+
+def get_store(engine=None):
+    if engine is None:
+        engine = query_engine
+    if engine == "pandas":
+        return table_store
+    if engine == "sqlite":
+        return sqlite_store
+    raise ValueError(f"Unknown query engine: {engine}")
+
+
+class GeneSummaryStore(TableStore):
+    """Holder for the per-gene coverage summary written by create_probes_table.py.
+
+    It is small enough to be read whole whichever engine is used and, like
+    the table, is read again when the file changes.
+    """
+
+    @property
+    def path(self):
+        return _resource_path(self.file_name)
+
+    def _load(self, path, signature):
+        df = pd.read_csv(path, comment="#", dtype={"Chromosome": str}).astype(
+            {col: "Int64" for col in ["Start", "End", "Span", "Probe Count"]}
+        )
+        # Rows are sorted by gene so are looked up by position in the index
+        self._table = df.set_index("Gene", drop=False)
+        self._signature = signature
+
+
+gene_summary_store = GeneSummaryStore(f"pscan_gene_summary_{table_version}.csv")
+
+
+class SharedCategories:
+    """One set of categories for the same column of several tables.
+
+    Values are numbered in the order they are first seen, so codes handed out
+    for one table stay valid as later tables add values. Each distinct value
+    is stored once however many tables use it.
+    """
+
+    def __init__(self):
+        self.values = pd.Index([], dtype=object)
+        self._dtype = None
+
+    def encode(self, column):
+        # Code of each value in the column, -1 for missing values
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = self.encode(pd.Series(column.cat.categories))
+            # Missing values have code -1 which picks the -1 added at the end
+            return np.append(codes, -1)[column.cat.codes.to_numpy()]
+        new = pd.Index(column.dropna().unique()).astype(object)
+        new = new[~new.isin(self.values)]
+        if len(new) != 0:
+            self.values = self.values.append(new)
+            self._dtype = None
+        return self.values.get_indexer(column.astype(object))
+
+    @property
+    def dtype(self):
+        if self._dtype is None:
+            self._dtype = pd.CategoricalDtype(self.values)
+        return self._dtype
+
+    def categorical(self, codes):
+        return pd.Categorical.from_codes(codes, dtype=self.dtype)
+
+
+# A table row is one probe set for one gene and rsID. Rows of different
+# releases with the same key are the same row, changed if any values differ
+_release_key = ["Probe Set ID", "Gene", "rsID"]
+_release_values = ["Chromosome", "Position", "Ref", "Alt", "Probe Count"]
+_release_codes = ["Probe Set ID", "Gene", "Chromosome", "Ref", "Alt"]
+release_status = ["", "Added", "Removed", "Changed"]
+
+
+def _encode_release(df, rsid_codec, categories):
+    # Every column as numbers so releases are joined on integers
+    columns = {col: categories[col].encode(df[col]) for col in _release_codes}
+    columns["rsID"] = rsid_codec.encode(df["rsID"], add=True)
+    for col in ["Position", "Probe Count"]:
+        columns[col] = pd.to_numeric(df[col]).to_numpy(
+            dtype="float64", na_value=np.nan
+        )
+    return pd.DataFrame(columns)
+
+
+def _same_values(df, old, new):
+    same = np.ones(df.shape[0], dtype=bool)
+    for col in _release_values:
+        a = df[f"{col} {old}"].to_numpy()
+        b = df[f"{col} {new}"].to_numpy()
+        same &= (a == b) | (np.isnan(a) & np.isnan(b))
+    return same
+
+
+class ReleaseTable(ProbeTable):
+    """Several releases of the table joined by join_releases.
+
+    versions are the releases that were joined, oldest first.
+    """
+
+    def __init__(self, df, versions, fingerprint=None, rsid_codec=None):
+        super().__init__(df, fingerprint, rsid_codec)
+        self.versions = list(versions)
+
+
+def join_releases(paths, fingerprint=None):
+    """Joins several releases of the table into one ReleaseTable.
+
+    paths maps each version to its table file, oldest first. The releases
+    are read one at a time and encoded against one RsidCodec and one
+    SharedCategories per text column, so only the numeric codes of each
+    release are held before they are outer joined on the row key. The
+    joined table has the values from the newest release each row is in, an
+    On Array column per release and a column per pair of consecutive
+    releases saying whether the row was added, removed or changed.
+    """
+    versions = list(paths)
+    rsid_codec = RsidCodec()
+    categories = {col: SharedCategories() for col in _release_codes}
+    joined = None
+    for version, path in paths.items():
+        df = _encode_release(TableStore._read_table(path), rsid_codec, categories)
+        df = df.drop_duplicates(_release_key).rename(
+            columns={col: f"{col} {version}" for col in _release_values}
+        )
+        df[f"present {version}"] = True
+        if joined is None:
+            joined = df
+        else:
+            joined = joined.merge(df, how="outer", on=_release_key)
+    present = {
+        version: joined[f"present {version}"].fillna(False).to_numpy(dtype=bool)
+        for version in versions
+    }
+
+    columns = {col: joined[col] for col in _release_key}
+    for col in _release_values:
+        values = np.full(joined.shape[0], np.nan)
+        for version in versions:
+            values = np.where(
+                present[version], joined[f"{col} {version}"].to_numpy(), values
+            )
+        columns[col] = values
+    for col in _release_codes:
+        columns[col] = categories[col].categorical(
+            np.asarray(columns[col]).astype("int64")
+        )
+    columns["rsID"] = joined["rsID"].to_numpy(dtype=np.uint64)
+    for col in ["Position", "Probe Count"]:
+        columns[col] = pd.Series(columns[col]).astype("Int64")
+    on_array = pd.CategoricalDtype(["No", "Yes"])
+    for version in versions:
+        columns[f"On Array {version}"] = pd.Categorical.from_codes(
+            present[version].astype("int8"), dtype=on_array
+        )
+    for old, new in zip(versions, versions[1:]):
+        status = np.select(
+            [
+                ~present[old] & present[new],
+                present[old] & ~present[new],
+                present[old] & present[new] & ~_same_values(joined, old, new),
+            ],
+            [1, 2, 3],
+            0,
+        )
+        columns[f"{old} to {new}"] = pd.Categorical.from_codes(
+            status, categories=release_status
+        )
+    return ReleaseTable(pd.DataFrame(columns), versions, fingerprint, rsid_codec)
+
+
+class ReleaseStore:
+    """Holder for the joined releases used by compare_releases.
+
+    The releases are joined again when a different list of them is asked for
+    or any of their files change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table = None
+        self._signature = None
+
+    @staticmethod
+    def paths(versions):
+        # The same file a TableStore for each release would read
+        return {
+            version: TableStore(f"pscan_table_{version}.csv").path
+            for version in versions
+        }
+
+    def get(self, versions):
+        paths = self.paths(versions)
+        signature = tuple(
+            (version, os.path.basename(path), *TableStore._file_signature(path))
+            for version, path in paths.items()
+        )
+        with self._lock:
+            if self._table is None or signature != self._signature:
+                self._table = join_releases(paths, signature)
+                self._signature = signature
+            return self._table
+
+
+release_store = ReleaseStore()
+
+
+def _sqlite_filter_by_genes(table, genes):
+    # Same rows and order as _filter_by_genes. Duplicate rows are grouped
+    # keeping the first one in the table, and NULL positions sort last like
+    # NaNs do in pandas
+    cols = ["Gene", "rsID", "Position", "Ref", "Alt", "Probe Count"]
+    selected = ", ".join(f'p."{col}"' for col in cols)
+    with table.connection() as conn:
+        table.load_ids(conn, genes)
+        df = table.read(
+            conn,
+            f"SELECT {selected}, MIN(p.row_id) AS row_id "
+            "FROM temp.query_ids AS q CROSS JOIN probes AS p ON p.Gene = q.id "
+            f"GROUP BY {selected} "
+            "ORDER BY p.Gene, p.Position IS NULL, p.Position, row_id",
+            cols + ["row_id"],
+        )
+    # Labelled by table row like the pandas engine
+    return df.set_index("row_id").rename_axis(None)
+
+
+def _sqlite_filter_by_rsids(table, rsids):
+    # Same rows and order as _filter_by_rsids: rows grouped by rsID in order
+    # of the rsID's first row in the table, then the rsIDs not on the array
+    with table.connection() as conn:
+        table.load_ids(conn, rsids)
+        found = table.read(
+            conn,
+            "SELECT p.Gene, p.rsID, MIN(p.row_id) AS row_id, "
+            "(SELECT MIN(f.row_id) FROM probes AS f WHERE f.rsID = p.rsID) AS first "
+            "FROM temp.query_ids AS q CROSS JOIN probes AS p ON p.rsID = q.id "
+            "GROUP BY p.rsID, p.Gene "
+            "ORDER BY first, row_id",
+            ["Gene", "rsID", "row_id", "first"],
+        )
+    found = found.loc[:, ["Gene", "rsID"]].assign(**{"On Array": "Yes"})
+    missing = pd.Series(rsids, name="rsID").drop_duplicates()
+    missing = missing.loc[~missing.isin(found["rsID"])]
+    missing = pd.DataFrame(
+        {"Gene": np.nan, "rsID": missing, "On Array": "No"},
+        columns=["Gene", "rsID", "On Array"],
     )
+    return pd.concat([found, missing], ignore_index=True)
+
+
+def _sqlite_filter_by_regions(table, regions):
+    # Same rows and order as _filter_by_regions
+    cols = ["Chromosome", "Position", "Gene", "rsID", "Ref", "Alt", "Probe Count"]
+    selected = ", ".join(f'p."{col}"' for col in cols)
+    regions = list(dict.fromkeys(regions))
+    query_regions = []
+    for i, region in enumerate(regions):
+        chromosome, span = region.rsplit(":", 1)
+        start, end = span.split("-")
+        query_regions.append((i, region, chromosome, int(start), int(end)))
+    with table.connection() as conn:
+        conn.execute("DELETE FROM temp.query_regions")
+        conn.executemany(
+            "INSERT INTO temp.query_regions VALUES (?, ?, ?, ?, ?)", query_regions
+        )
+        found = table.read(
+            conn,
+            f"SELECT q.ord, q.region, {selected}, MIN(p.row_id) AS row_id "
+            "FROM temp.query_regions AS q CROSS JOIN probes AS p "
+            "ON p.chromosome_key = q.chromosome "
+            "AND p.Position BETWEEN q.start AND q.end "
+            f"GROUP BY q.ord, {selected} "
+            "ORDER BY q.ord, p.Position, row_id",
+            ["ord", "Region"] + cols + ["row_id"],
+        )
+    found_regions = set(found["Region"])
+    missing = [region for region in regions if region not in found_regions]
+    found = found.drop(columns=["ord", "row_id"]).assign(**{"On Array": "Yes"})
+    missing = pd.DataFrame(
+        {"Region": missing, "On Array": "No"}, columns=found.columns
+    )
+    order = {region: i for i, region in enumerate(regions)}
+    filtered_table = pd.concat([found, missing], ignore_index=True)
+    filtered_table = filtered_table.iloc[
+        np.argsort(filtered_table["Region"].map(order).to_numpy(), kind="stable")
+    ]
+    return filtered_table.reset_index(drop=True).astype(
+        {"Position": "Int64", "Probe Count": "Int64"}
+    )
+
+
+def _allele_name(gene, allele):
+    # Definition files may give the allele as *2 or as the full CYP2C19*2
+    if allele.upper().startswith(gene.upper()):
+        return allele
+    if allele.startswith("*"):
+        return gene + allele
+    return f"{gene} {allele}"
+
+
+def read_allele_definitions(directory):
+    """Reads every .tsv file in directory into one table of defining variants.
+
+    Each file needs Gene and Allele columns and an rsID column and/or
+    Chromosome and Position columns. Each row is one variant that defines the
+    allele. Lines starting with # are ignored.
+    """
+    frames = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".tsv"):
+            continue
+        df = pd.read_csv(
+            os.path.join(directory, file_name), sep="\t", comment="#", dtype=str
+        )
+        df.columns = df.columns.str.strip()
+        if not {"Gene", "Allele"}.issubset(df.columns) or not (
+            "rsID" in df.columns or {"Chromosome", "Position"}.issubset(df.columns)
+        ):
+            raise ValueError(
+                f"{file_name} needs Gene, Allele and either rsID or "
+                "Chromosome and Position columns"
+            )
+        # Columns a file doesn't have are added as all missing text columns
+        # so the string handling below works on every column
+        frames.append(
+            df.reindex(
+                columns=["Gene", "Allele", "rsID", "Chromosome", "Position"]
+            ).astype(object)
+        )
+    if len(frames) == 0:
+        raise FileNotFoundError(f"No allele definition files found in {directory}")
+    definitions = pd.concat(frames, ignore_index=True)
+    definitions = definitions.dropna(subset=["Gene", "Allele"])
+    for col in ["Gene", "Allele", "rsID", "Chromosome", "Position"]:
+        definitions[col] = definitions[col].map(str.strip, na_action="ignore")
+    definitions["Allele"] = [
+        _allele_name(gene, allele)
+        for gene, allele in zip(definitions["Gene"], definitions["Allele"])
+    ]
+    definitions["rsID"] = definitions["rsID"].map(str.lower, na_action="ignore")
+    definitions["Chromosome"] = definitions["Chromosome"].map(
+        normalize_chromosome, na_action="ignore"
+    )
+    definitions["Position"] = pd.to_numeric(
+        definitions["Position"], errors="coerce"
+    ).astype("Int64")
+    return definitions.reset_index(drop=True)
+
+
+class AlleleIndex:
+    """Allele definitions joined against the probe table.
+
+    Every defining variant is looked up in the table once when the index is
+    built, by rsID or by chromosome and position when the rsID isn't found.
+    Queries then only pick out the rows for the alleles asked for.
+    """
+
+    def __init__(self, definitions, table, signature=None):
+        self.signature = signature
+        on_array = table.has_rsids(definitions["rsID"])
+        check_position = (
+            ~on_array
+            & definitions["Chromosome"].notna().to_numpy()
+            & definitions["Position"].notna().to_numpy()
+        )
+        for i in np.flatnonzero(check_position):
+            on_array[i] = table.has_position(
+                definitions["Chromosome"].iat[i], int(definitions["Position"].iat[i])
+            )
+
+        df = definitions.assign(**{"On Array": np.where(on_array, "Yes", "No")})
+        keys = df["Allele"].map(_normalize_allele)
+        variants_on_array = pd.Series(on_array).groupby(keys).transform("sum")
+        variants = keys.groupby(keys).transform("size")
+        df["Variants On Array"] = (
+            variants_on_array.astype(str) + "/" + variants.astype(str)
+        )
+        self.df = df.loc[
+            :,
+            [
+                "Allele",
+                "Gene",
+                "rsID",
+                "Chromosome",
+                "Position",
+                "On Array",
+                "Variants On Array",
+            ],
+        ]
+        self.index = _build_index(keys)
+        self.names = SymbolIndex(df["Allele"].unique())
+
+
+class AlleleStore:
+    """Holder for the allele definitions in a directory of .tsv files.
+
+    The definitions are read again when a file in the directory is added,
+    removed or changed. The join against the probe table is redone when
+    either the definitions or the table change.
+    """
+
+    def __init__(self, directory_name):
+        self.directory_name = directory_name
+        self._lock = threading.Lock()
+        self._definitions = None
+        self._signature = None
+        self._index = None
+        self._table = None
+
+    @property
+    def path(self):
+        return _resource_path(self.directory_name)
+
+    @staticmethod
+    def _directory_signature(path):
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"Allele definitions directory not found: {path}")
+        signature = []
+        for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+            if entry.name.endswith(".tsv"):
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def get(self, table):
+        path = self.path
+        signature = self._directory_signature(path)
+        with self._lock:
+            if self._definitions is None or signature != self._signature:
+                self._definitions = read_allele_definitions(path)
+                self._signature = signature
+                self._index = None
+            if self._index is None or self._table is not table:
+                self._index = AlleleIndex(self._definitions, table, signature)
+                self._table = table
+            return self._index
+
+
+allele_store = AlleleStore("allele_definitions")
+
+
+def _filter_by_alleles(allele_index, alleles):
+    # Rows for each allele in the order they were asked for. Alleles without
+    # a definition are left out and reported by suggest_alleles
+    offsets = [
+        allele_index.index[allele]
+        for allele in alleles
+        if allele in allele_index.index
+    ]
+    if len(offsets) == 0:
+        return allele_index.df.iloc[:0]
+    return allele_index.df.iloc[np.concatenate(offsets)].reset_index(drop=True)
+
 
-    data_type = _find_data_type(query_data)
+class QueryCache:
+    """LRU cache of query results.
+
+    Results are keyed on the table's fingerprint, the query type and the
+    sorted unique query IDs, so resubmitting the same IDs in any order or with
+    repeats is a hit. The cache is bounded by the total rows and bytes of the
+    results it holds and is emptied as soon as a query comes in for a table
+    with a different fingerprint, i.e. after the table file has changed.
+
+    When cache_file is given the cache is read from it on creation and
+    written back to it with save().
+    """
+
+    def __init__(
+        self, max_rows=2_000_000, max_bytes=256 * 1024 ** 2, cache_file=None
+    ):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.cache_file = cache_file
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._bytes = 0
+        self._fingerprint = None
+        self._lock = threading.Lock()
+        if cache_file is not None and os.path.isfile(cache_file):
+            self.load()
+
+    @staticmethod
+    def key(query_data, data_type, fingerprint):
+        return fingerprint, data_type, tuple(sorted(set(query_data)))
+
+    def _check_fingerprint(self, fingerprint):
+        if fingerprint != self._fingerprint:
+            self._clear()
+            self._fingerprint = fingerprint
+
+    def _clear(self):
+        self._entries.clear()
+        self._rows = 0
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            self._check_fingerprint(key[0])
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, df):
+        rows = df.shape[0]
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if rows > self.max_rows or size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_fingerprint(key[0])
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._rows -= old[1]
+                self._bytes -= old[2]
+            while self._entries and (
+                self._rows + rows > self.max_rows or self._bytes + size > self.max_bytes
+            ):
+                _, (_, old_rows, old_size) = self._entries.popitem(last=False)
+                self._rows -= old_rows
+                self._bytes -= old_size
+                self.evictions += 1
+            self._entries[key] = (df, rows, size)
+            self._rows += rows
+            self._bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def info(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "rows": self._rows,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        with self._lock:
+            state = (self._fingerprint, list(self._entries.items()))
+        with open(self.cache_file, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self):
+        # A cache file that can't be read is ignored and overwritten on save
+        try:
+            with open(self.cache_file, "rb") as f:
+                fingerprint, entries = pickle.load(f)
+        except Exception:
+            return
+        with self._lock:
+            self._clear()
+            self._fingerprint = fingerprint
+            for key, (df, rows, size) in entries:
+                self._entries[key] = (df, rows, size)
+                self._rows += rows
+                self._bytes += size
+
+
+# Setting PSCAN_QUERY_CACHE_FILE keeps cached results across restarts
+query_cache = QueryCache(cache_file=os.environ.get("PSCAN_QUERY_CACHE_FILE"))
+atexit.register(lambda: query_cache.save())
+
+
+def suggest_genes(genes, limit=3):
+    """Maps each gene that isn't in the table to similarly spelled genes."""
+    gene_names = get_store().get().gene_names
+    return {
+        gene: gene_names.suggest(gene, limit)
+        for gene in dict.fromkeys(genes)
+        if gene not in gene_names
+    }
+
+
+def suggest_alleles(alleles, limit=3):
+    """Maps each allele without a definition to similarly named alleles."""
+    allele_index = allele_store.get(get_store().get())
+    return {
+        allele: allele_index.names.suggest(allele, limit)
+        for allele in dict.fromkeys(alleles)
+        if allele not in allele_index.index
+    }
+
+
+def _restore_query_order(df, query_data, data_type):
+    # Cached results are shared by every ordering of the same IDs. Gene
+    # results are sorted so don't depend on the order IDs were entered in but
+    # rsIDs that aren't on the array and region results follow the query
     if data_type == "gene":
-        pharmacoscan_table = _filter_by_genes(pharmacoscan_table, query_data)
+        return df.copy()
+    order = {id_: i for i, id_ in enumerate(dict.fromkeys(query_data))}
+    if data_type == "region":
+        positions = df["Region"].map(order).to_numpy()
+    elif data_type == "allele":
+        positions = df["Allele"].map(_normalize_allele).map(order).to_numpy()
+    else:
+        # Rows on the array come first in table order
+        positions = np.where(df["On Array"] == "Yes", -1, df["rsID"].map(order))
+    return df.iloc[np.argsort(positions, kind="stable")].reset_index(drop=True)
+
+
+def _filter_table(table, query_data, data_type, cancelled=None):
+    if isinstance(table, SqliteTable):
+        if data_type == "gene":
+            return _sqlite_filter_by_genes(table, query_data)
+        if data_type == "rsid":
+            return _sqlite_filter_by_rsids(table, query_data)
+        if data_type == "region":
+            return _sqlite_filter_by_regions(table, query_data)
+        return _filter_by_alleles(allele_store.get(table), query_data)
+    pharmacoscan_table = table.df
+    if data_type == "gene":
+        pharmacoscan_table = _filter_by_genes(table, query_data)
     if data_type == "rsid":
-        pharmacoscan_table = _filter_by_rsids(pharmacoscan_table, query_data)
+        pharmacoscan_table = _filter_by_rsids(table, query_data)
+    if data_type == "region":
+        pharmacoscan_table = _filter_by_regions(table, query_data, cancelled)
+    if data_type == "allele":
+        pharmacoscan_table = _filter_by_alleles(allele_store.get(table), query_data)
     return pharmacoscan_table
 
 
-def export_data(df, file_path):
-    ext = os.path.splitext(file_path)[-1]
-    try:
-        if ext == ".txt" or ext == ".tsv":
-            df.to_csv(file_path, sep="\t", index=False)
-        elif ext == ".csv":
-            df.to_csv(file_path, index=False)
-        elif ext == ".xlsx":
-            df.to_excel(file_path, index=False)
-        elif ext == ".xls":
-            # xls files are deprecated so will be changed to xlsx
-            file_path = file_path + "x"
-            df.to_excel(file_path, index=False)
+class QueryCancelled(Exception):
+    pass
+
+
+def _check_cancelled(cancelled):
+    if cancelled is not None and cancelled():
+        raise QueryCancelled()
+
+
+def query_table(query_data, data_type=None, stats=None, engine=None, cancelled=None):
+    # stats is an instrumentation.QueryStats that the load and filter stages
+    # are recorded on. engine picks the table queried, see get_store.
+    # cancelled is checked between stages, and every 10,000 regions while
+    # looking up regions, and QueryCancelled is raised once it returns True
+    if stats is None:
+        stats = NullStats()
+    with stats.stage("load_table") as record:
+        table = get_store(engine).get()
+        record["rows_out"] = table.row_count
+    _check_cancelled(cancelled)
+
+    if data_type is None:
+        data_type = find_data_type(query_data)
+    with stats.stage("filter", rows_in=table.row_count) as record:
+        key = query_cache.key(query_data, data_type, table.fingerprint)
+        if data_type == "allele":
+            # Results also go stale when the allele definitions change
+            key += (allele_store.get(table).signature,)
+        cached = query_cache.get(key)
+        record["cache"] = "miss" if cached is None else "hit"
+        if cached is not None:
+            pharmacoscan_table = _restore_query_order(cached, query_data, data_type)
+        else:
+            pharmacoscan_table = _filter_table(
+                table, query_data, data_type, cancelled
+            )
+            query_cache.put(key, pharmacoscan_table)
+        record["rows_out"] = pharmacoscan_table.shape[0]
+    return pharmacoscan_table
+
+
+def query_gene_summary(genes=None, stats=None):
+    """Returns the coverage summary of each gene, or of every gene if None.
+
+    Answered from the summary written when the table is built, so even the
+    whole array doesn't need any rows of the table. Genes that aren't on the
+    array are left out, the same as gene queries, and rows are sorted by
+    gene.
+    """
+    if stats is None:
+        stats = NullStats()
+    with stats.stage("load_table") as record:
+        summary = gene_summary_store.get()
+        record["rows_out"] = summary.shape[0]
+
+    with stats.stage("filter", rows_in=summary.shape[0]) as record:
+        if genes is not None:
+            summary = summary.loc[summary.index.isin(genes)]
+        summary = summary.reset_index(drop=True)
+        record["rows_out"] = summary.shape[0]
+    return summary
+
+
+def _release_rows(table, rows):
+    # Rows picked out of the joined releases, turned back into text
+    cols = [
+        "Probe Set ID",
+        "Gene",
+        "rsID",
+        "Chromosome",
+        "Position",
+        "Ref",
+        "Alt",
+        "Probe Count",
+    ]
+    cols += [col for col in table.df.columns if col not in cols]
+    return table.decode(rows.loc[:, cols]).reset_index(drop=True)
+
+
+def _missing_releases(table, key, ids, columns):
+    # Rows for IDs that aren't in any of the releases
+    missing = pd.DataFrame({key: ids}, columns=columns)
+    for version in table.versions:
+        missing[f"On Array {version}"] = "No"
+    return missing
+
+
+def compare_releases(query_data, versions, data_type=None, stats=None):
+    """Queries several releases of the table side by side.
+
+    versions are the releases to compare, oldest first, as in the
+    pscan_table_<version>.csv file names. Each result row has an On Array
+    column per release and, for each pair of consecutive releases, whether
+    the row was added, removed or changed in the later one. The releases are
+    joined once when first compared, see join_releases, so each query only
+    looks up the rows it asks for in the joined table. Rows are found by
+    their values in the newest release they are in, so a region only finds
+    a row that has moved if it covers the row's newest position. IDs that
+    aren't in any release are listed with On Array set to No, except for
+    genes.
+    """
+    if stats is None:
+        stats = NullStats()
+    versions = list(dict.fromkeys(versions))
+    if len(versions) < 2:
+        raise ValueError("At least two releases are needed to compare")
+    if data_type is None:
+        data_type = find_data_type(query_data)
+    if data_type not in ["gene", "rsid", "region"]:
+        raise ValueError(f"{data_type} queries can't be compared across releases")
+    with stats.stage("load_table") as record:
+        table = release_store.get(versions)
+        record["rows_out"] = table.row_count
+
+    with stats.stage("filter", rows_in=table.row_count) as record:
+        ids = list(dict.fromkeys(query_data))
+        if data_type == "gene":
+            found = _select_rows(table.df, "Gene", ids, table.gene_index)
+            df = _release_rows(table, found).sort_values(
+                ["Gene", "Position"], kind="stable", ignore_index=True
+            )
+        elif data_type == "rsid":
+            found = _select_rows(
+                table.df, "rsID", table.rsid_codec.encode(ids), table.rsid_index
+            )
+            df = _release_rows(table, found)
+            found_rsids = set(df["rsID"])
+            missing = [rsid for rsid in ids if rsid not in found_rsids]
+            df = pd.concat(
+                [df, _missing_releases(table, "rsID", missing, df.columns)],
+                ignore_index=True,
+            )
         else:
-            # any other extension will be treated as .tsv files
-            # may need to fix in future if needed
-            df.to_csv(file_path, sep="\t", index=False)
+            offsets, labels, missing = _lookup_regions(table, ids)
+            df = _release_rows(table, table.df.iloc[offsets])
+            df.insert(0, "Region", labels)
+            df = pd.concat(
+                [df, _missing_releases(table, "Region", missing, df.columns)],
+                ignore_index=True,
+            )
+            # Regions with no probes stay in the position they were entered in
+            order = {region: i for i, region in enumerate(ids)}
+            df = df.iloc[
+                np.argsort(df["Region"].map(order).to_numpy(), kind="stable")
+            ].reset_index(drop=True)
+        df = df.astype({"Position": "Int64", "Probe Count": "Int64"})
+        record["rows_out"] = df.shape[0]
+    return df
+
+
+# Column each query type's results are joined back to the panels on
+_panel_keys = {"gene": "Gene", "rsid": "rsID", "region": "Region", "allele": "Allele"}
+
+
+def _panel_summary(membership):
+    rows = []
+    for panel, group in membership.groupby("Panel", sort=False):
+        on_array = group["On Array"].to_numpy()
+        rows.append(
+            {
+                "Panel": panel,
+                "IDs": len(group),
+                "On Array": int(on_array.sum()),
+                "Not On Array": int((~on_array).sum()),
+                "Coverage (%)": round(100 * on_array.mean(), 1),
+                "Not On Array IDs": ",".join(group.loc[~on_array, "Query"]),
+            }
+        )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "Panel",
+            "IDs",
+            "On Array",
+            "Not On Array",
+            "Coverage (%)",
+            "Not On Array IDs",
+        ],
+    )
+
+
+def query_panels(panels, stats=None, engine=None, cancelled=None):
+    """Queries every panel with one query per type of ID.
+
+    panels maps each panel name to its (data type, ID) pairs, as returned by
+    parse_panel_text and read_panels. The IDs of all the panels are pooled so
+    each type is queried once however many panels there are, then the rows
+    are joined back to each panel. Returns the rows of every panel with Panel
+    and Query columns added and a summary of each panel's coverage.
+    cancelled is passed on to query_table.
+    """
+    if stats is None:
+        stats = NullStats()
+    membership = pd.DataFrame(
+        [
+            (panel, data_type, id_)
+            for panel, ids in panels.items()
+            for data_type, id_ in ids
+        ],
+        columns=["Panel", "Type", "Query"],
+    )
+    membership["order"] = np.arange(membership.shape[0])
+    results = {}
+    for data_type in membership["Type"].unique():
+        ids = membership.loc[membership["Type"] == data_type, "Query"].unique()
+        results[data_type] = query_table(
+            ids.tolist(), data_type, stats=stats, engine=engine, cancelled=cancelled
+        )
+
+    with stats.stage("panels", rows_in=membership.shape[0]) as record:
+        frames = []
+        for data_type, result in results.items():
+            keys = result[_panel_keys[data_type]]
+            if data_type == "allele":
+                keys = keys.map(_normalize_allele)
+            if "On Array" not in result.columns:
+                # Gene results only list genes that are on the array
+                result = result.assign(**{"On Array": "Yes"})
+            group = membership.loc[membership["Type"] == data_type]
+            frames.append(group.merge(result.assign(Query=keys), how="left"))
+        combined = pd.concat(frames, ignore_index=True)
+        combined = combined.iloc[
+            np.argsort(combined["order"].to_numpy(), kind="stable")
+        ].reset_index(drop=True)
+        combined["On Array"] = combined["On Array"].fillna("No")
+
+        hits = combined.loc[combined["On Array"] == "Yes", "order"].unique()
+        membership["On Array"] = membership["order"].isin(hits)
+        summary = _panel_summary(membership)
+
+        cols = [
+            col
+            for col in combined.columns
+            if col not in ["Panel", "Type", "Query", "order", "On Array"]
+        ]
+        combined = combined.loc[:, ["Panel", "Query", *cols, "On Array"]]
+        # Rows for IDs that aren't on the array turn integer columns to floats.
+        # Going through object keeps older pandas from warning about casting
+        # the NaNs hidden under a Float64 mask
+        for col in ["Position", "Probe Count"]:
+            if col in cols:
+                combined[col] = combined[col].astype(object).astype("Int64")
+        record["rows_out"] = combined.shape[0]
+    return combined, summary
+
+
+export_formats = {
+    ".csv": "csv",
+    ".tsv": "tsv",
+    ".txt": "tsv",
+    ".xlsx": "xlsx",
+    ".xls": "xlsx",
+}
+
+
+def export_format(file_path):
+    # A .gz extension gzips the csv/tsv file named by the extension before it
+    root, ext = os.path.splitext(file_path)
+    if ext.lower() == ".gz":
+        ext = os.path.splitext(root)[-1]
+    # any other extension will be treated as .tsv files
+    return export_formats.get(ext.lower(), "tsv")
+
+
+def summary_file_path(file_path):
+    # results.tsv.gz -> results.summary.tsv.gz
+    root, ext = os.path.splitext(file_path)
+    if ext.lower() == ".gz":
+        root, inner_ext = os.path.splitext(root)
+        ext = inner_ext + ext
+    return f"{root}.summary{ext}"
+
+
+def _append_rows(sheet, df):
+    # Blank cells instead of NaN the same way df.to_excel writes them
+    values = df.astype(object).where(df.notna(), None)
+    for row in values.to_numpy().tolist():
+        sheet.append(row)
+
+
+class ResultWriter:
+    """Writes results to a csv/tsv/xlsx file or to stdout a chunk at a time.
+
+    csv and tsv files ending in .gz are gzipped. xlsx files are written with
+    openpyxl's write-only mode so rows are flushed out as they are added
+    instead of building up the whole workbook in memory.
+
+    write_summary() adds a summary of the results, such as the coverage of
+    each panel, as a second sheet of xlsx files or as a file next to csv and
+    tsv files named by summary_file_path.
+    """
+
+    def __init__(self, file_path, file_format=None):
+        self.file_path = file_path
+        self.file_format = file_format or export_format(file_path)
+        self.rows_written = 0
+        self._header_written = False
+        self._handle = None
+        self._workbook = None
+        self._sheet = None
+        if self.file_format == "xlsx":
+            from openpyxl import Workbook
+
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet()
+        elif file_path is None or file_path == "-":
+            self._handle = sys.stdout
+        elif file_path.lower().endswith(".gz"):
+            self._handle = gzip.open(file_path, "wt", newline="")
+        else:
+            self._handle = open(file_path, "w", newline="")
+
+    def write(self, df):
+        if self.file_format == "xlsx":
+            if not self._header_written:
+                self._sheet.append(df.columns.tolist())
+            _append_rows(self._sheet, df)
+        else:
+            sep = "," if self.file_format == "csv" else "\t"
+            df.to_csv(
+                self._handle, sep=sep, index=False, header=not self._header_written
+            )
+        self._header_written = True
+        self.rows_written += df.shape[0]
+
+    def write_summary(self, df, title="Summary"):
+        if self.file_format == "xlsx":
+            self._sheet.title = "Results"
+            sheet = self._workbook.create_sheet(title)
+            sheet.append(df.columns.tolist())
+            _append_rows(sheet, df)
+            return
+        if self.file_path is None or self.file_path == "-":
+            raise ValueError("A summary can't be written next to stdout")
+        writer = ResultWriter(summary_file_path(self.file_path), self.file_format)
+        try:
+            writer.write(df)
+        finally:
+            writer.close()
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.save(self.file_path)
+        elif self._handle is not None and self._handle is not sys.stdout:
+            self._handle.close()
+        else:
+            sys.stdout.flush()
+
+
+def export_data(df, file_path, progress=None, chunk_rows=50000, summary=None):
+    # progress is called as progress(rows_written, total_rows) after every
+    # chunk so callers can show how far along a large export is. summary is
+    # written with ResultWriter.write_summary when given
+    if os.path.splitext(file_path)[-1] == ".xls":
+        # xls files are deprecated so will be changed to xlsx
+        file_path = file_path + "x"
+    try:
+        writer = ResultWriter(file_path)
+        try:
+            for start in range(0, max(df.shape[0], 1), chunk_rows):
+                writer.write(df.iloc[start : start + chunk_rows])
+                if progress is not None:
+                    progress(writer.rows_written, df.shape[0])
+            if summary is not None:
+                writer.write_summary(summary)
+        finally:
+            writer.close()
     except Exception:
         ex_type, *_ = sys.exc_info()
         error = ex_type
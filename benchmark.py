@@ -0,0 +1,415 @@
+"""
+Benchmarks for the build, load, query and export paths.
+
+Synthetic annot files are generated at each requested scale with
+synthetic_annot.py and run through the same code the tool uses:
+- create_probes_table.build_table and write_output (the full build pipeline)
+- loading the table through TableStore from the csv and, with pyarrow
+  installed, from the Feather file
+- query_table for genes, rsIDs and regions on both query engines, and a gene
+  panel from the cache
+- create_probes_table.write_sqlite, the SQLite table for the SQLite engine
+- create_probes_table.summarize_genes and query_gene_summary for every gene
+  and for a gene panel
+- _filter_by_genes and _filter_by_rsids with and without the lookup indexes
+- the memory the loaded table takes in its compact form against the same
+  table with every column decoded back to strings
+- join_releases on two copies of the table and the memory the joined
+  releases take
+- export_data to csv, tsv, gzipped tsv and xlsx
+- showing results in ResultTable when a display is available
+- starting the GUI: the time from launching Python until app is imported and,
+  with a display, until the window is drawn. This fails when it is slower
+  than --startup-target or when importing app pulls in pandas
+
+Timings are written to a json file named after the current git commit so
+runs can be compared across commits with --compare.
+
+Usage:
+python benchmark.py --scales 10000 100000 --repeat 5
+python benchmark.py --scales 10000 --compare benchmark_results/abc1234.json
+python benchmark.py --startup-only --startup-target 0.5
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import app_utils
+import create_probes_table
+from app_utils import (
+    QueryCache,
+    TableStore,
+    _filter_by_genes,
+    _filter_by_rsids,
+    export_data,
+    query_gene_summary,
+    query_table,
+)
+from synthetic_annot import write_annot
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def _package_version(name):
+    try:
+        return __import__(name).__version__
+    except ImportError:
+        return None
+
+
+def time_call(func, repeat=1):
+    """Runs func repeat times and returns the timings along with its result."""
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    timing = {
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+    }
+    return timing, result
+
+
+def _query_sets(df, rng):
+    genes = df["Gene"].dropna().unique()
+    rsids = df["rsID"].dropna().unique()
+    gene_query = rng.choice(genes, size=min(10, len(genes)), replace=False).tolist()
+    panel_query = rng.choice(genes, size=min(100, len(genes)), replace=False).tolist()
+    rsid_query = rng.choice(rsids, size=min(1000, len(rsids)), replace=False).tolist()
+    # Some rsIDs that aren't on the array
+    rsid_query += [f"rs{i}" for i in range(900000000, 900000100)]
+    positions = df.dropna(subset=["Chromosome", "Position"]).sample(
+        n=min(100, df.shape[0]), random_state=0
+    )
+    region_query = [
+        f"{chromosome}:{max(int(position) - 500000, 1)}-{int(position) + 500000}"
+        for chromosome, position in zip(positions["Chromosome"], positions["Position"])
+    ]
+    return {
+        "gene": gene_query,
+        "gene_panel": panel_query,
+        "rsid": rsid_query,
+        "region": region_query,
+    }
+
+
+def _bench_render(df, repeat):
+    try:
+        from tkinter import Tk, TclError
+
+        from result_table import ResultTable
+
+        root = Tk()
+    except Exception:
+        return None
+    try:
+        table = ResultTable(root)
+
+        def render():
+            table.show(df)
+            root.update_idletasks()
+
+        timing, _ = time_call(render, repeat)
+    except TclError:
+        timing = None
+    finally:
+        root.destroy()
+    return timing
+
+
+_startup_script = """
+import json, os, sys, time
+import app
+imported = time.time()
+pandas_imported = "pandas" in sys.modules
+try:
+    window = app.App()
+    window.update()
+    shown = time.time()
+except Exception:
+    shown = None
+print(json.dumps([imported, shown, pandas_imported]), flush=True)
+# Don't wait on the background import started by the window
+os._exit(0)
+"""
+
+
+def run_startup(repeat):
+    """Times launching the GUI in a fresh Python process."""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    imported = []
+    shown = []
+    pandas_imported = False
+    for _ in range(repeat):
+        start = time.time()
+        result = subprocess.run(
+            [sys.executable, "-c", _startup_script],
+            capture_output=True,
+            text=True,
+            cwd=package_dir,
+            check=True,
+        )
+        import_done, window_done, pandas_loaded = json.loads(
+            result.stdout.strip().splitlines()[-1]
+        )
+        imported.append(import_done - start)
+        if window_done is not None:
+            shown.append(window_done - start)
+        pandas_imported = pandas_imported or pandas_loaded
+    results = {"pandas_imported": pandas_imported}
+    for name, seconds in [("import_app", imported), ("show_window", shown)]:
+        if len(seconds) != 0:
+            results[name] = {
+                "seconds": seconds,
+                "min": min(seconds),
+                "median": statistics.median(seconds),
+            }
+    return results
+
+
+def check_startup(startup, target):
+    # The window time is used when there is a display to draw it on
+    timing = startup.get("show_window", startup["import_app"])
+    problems = []
+    if startup["pandas_imported"]:
+        problems.append("importing app imported pandas")
+    if timing["median"] > target:
+        problems.append(
+            f"startup took {timing['median']:.3f}s, over the {target}s target"
+        )
+    return problems
+
+
+def run_scale(probe_sets, work_dir, repeat, seed=0):
+    results = {}
+    annot_file = os.path.join(work_dir, f"synthetic_{probe_sets}.annot.csv")
+    table_file = os.path.join(work_dir, f"pscan_table_synthetic_{probe_sets}.csv")
+
+    results["generate_annot"], _ = time_call(
+        lambda: write_annot(annot_file, probe_sets, seed)
+    )
+    results["build_table"], (data, column_types, manifest) = time_call(
+        lambda: create_probes_table.build_table(annot_file)
+    )
+    # create_header reads these from the module like when run as a script
+    create_probes_table.file_path_in = annot_file
+    create_probes_table.version = "synthetic"
+    header = create_probes_table.create_header()
+    results["write_output"], _ = time_call(
+        lambda: create_probes_table.write_output(data, table_file, header)
+    )
+    results["table_rows"] = data.shape[0]
+
+    store = TableStore(table_file)
+    results["load_csv"], table = time_call(store.reload, repeat)
+    if create_probes_table.pa is not None and app_utils.feather is not None:
+        feather_file = os.path.splitext(table_file)[0] + ".feather"
+        create_probes_table.write_feather(table_file, feather_file, header)
+        results["load_feather"], table = time_call(store.reload, repeat)
+    app_utils.table_store = store
+    sqlite_file = os.path.splitext(table_file)[0] + ".sqlite"
+    results["write_sqlite"], _ = time_call(
+        lambda: create_probes_table.write_sqlite(table_file, sqlite_file, header)
+    )
+    app_utils.sqlite_store = app_utils.SqliteStore(sqlite_file)
+    summary_file = os.path.join(
+        work_dir, f"pscan_gene_summary_synthetic_{probe_sets}.csv"
+    )
+    results["summarize_genes"], summary = time_call(
+        lambda: create_probes_table.summarize_genes(table_file)
+    )
+    create_probes_table.write_output(summary, summary_file, header)
+    app_utils.gene_summary_store = app_utils.GeneSummaryStore(summary_file)
+    # Queries are timed without the result cache so repeats measure filtering
+    app_utils.query_cache = QueryCache(max_rows=0)
+
+    # Deep memory use of the compact table the tool keeps against the plain
+    # string columns it was read from
+    df = table.decode(table.df)
+    results["table_memory_mb"] = table.df.memory_usage(deep=True).sum() / 1024 ** 2
+    results["table_memory_decoded_mb"] = df.memory_usage(deep=True).sum() / 1024 ** 2
+    results["join_releases"], joined = time_call(
+        lambda: app_utils.join_releases({"a": table_file, "b": table_file})
+    )
+    results["joined_memory_mb"] = (
+        joined.df.memory_usage(deep=True).sum() / 1024 ** 2
+    )
+    queries = _query_sets(df, np.random.default_rng(seed))
+    for name, query in queries.items():
+        data_type = "gene" if name == "gene_panel" else name
+        results[f"query_table_{name}"], _ = time_call(
+            lambda: query_table(query, data_type, engine="pandas"), repeat
+        )
+        results[f"query_table_sqlite_{name}"], _ = time_call(
+            lambda: query_table(query, data_type, engine="sqlite"), repeat
+        )
+    results["query_gene_summary_all"], _ = time_call(query_gene_summary, repeat)
+    results["query_gene_summary_gene_panel"], _ = time_call(
+        lambda: query_gene_summary(queries["gene_panel"]), repeat
+    )
+    app_utils.query_cache = QueryCache()
+    query_table(queries["gene_panel"], "gene")
+    results["query_table_gene_panel_cached"], _ = time_call(
+        lambda: query_table(queries["gene_panel"][::-1], "gene"), repeat
+    )
+    results["filter_by_genes_indexed"], _ = time_call(
+        lambda: _filter_by_genes(table, queries["gene"]), repeat
+    )
+    results["filter_by_genes_scan"], _ = time_call(
+        lambda: _filter_by_genes(table, queries["gene"], use_index=False), repeat
+    )
+    results["filter_by_rsids_indexed"], _ = time_call(
+        lambda: _filter_by_rsids(table, queries["rsid"]), repeat
+    )
+    results["filter_by_rsids_scan"], _ = time_call(
+        lambda: _filter_by_rsids(table, queries["rsid"], use_index=False), repeat
+    )
+
+    export_df = query_table(queries["gene_panel"], "gene")
+    results["export_rows"] = export_df.shape[0]
+    for ext in ["csv", "tsv", "tsv.gz", "xlsx"]:
+        out_file = os.path.join(work_dir, f"export_{probe_sets}.{ext}")
+        results[f"export_{ext}"], _ = time_call(
+            lambda: export_data(export_df, out_file), repeat
+        )
+
+    render = _bench_render(export_df, repeat)
+    if render is not None:
+        results["render"] = render
+    return results
+
+
+def compare(results, previous):
+    print(f"{'scale':>10} {'benchmark':<32} {'before':>10} {'after':>10} {'ratio':>7}")
+    for scale, timings in results["results"].items():
+        before = previous["results"].get(scale, {})
+        for name, timing in timings.items():
+            if not isinstance(timing, dict) or not isinstance(before.get(name), dict):
+                continue
+            old = before[name]["median"]
+            new = timing["median"]
+            ratio = new / old if old else float("nan")
+            print(f"{scale:>10} {name:<32} {old:>10.4f} {new:>10.4f} {ratio:>7.2f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pharmacoscan query tool on synthetic data."
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[10000],
+        help="Numbers of probe sets to generate (default: %(default)s)",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--out", help="Results json file (default: benchmark_results/<commit>.json)"
+    )
+    parser.add_argument("--compare", help="Previous results json to compare against")
+    parser.add_argument(
+        "--work-dir", help="Directory for generated files (default: a temp dir)"
+    )
+    parser.add_argument(
+        "--startup-target",
+        type=float,
+        default=1.0,
+        help="Slowest allowed GUI startup in seconds (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--startup-only",
+        action="store_true",
+        help="Only run the GUI startup benchmark",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    commit = _git_commit()
+    results = {
+        "commit": commit,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "pyarrow": _package_version("pyarrow"),
+        "results": {},
+    }
+    print("Running startup...", file=sys.stderr)
+    results["startup"] = run_startup(args.repeat)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        scales = [] if args.startup_only else args.scales
+        for probe_sets in scales:
+            print(f"Running {probe_sets} probe sets...", file=sys.stderr)
+            results["results"][str(probe_sets)] = run_scale(
+                probe_sets, work_dir, args.repeat, args.seed
+            )
+
+    out_file = args.out
+    if out_file is None:
+        os.makedirs("benchmark_results", exist_ok=True)
+        out_file = os.path.join("benchmark_results", f"{commit or 'local'}.json")
+    with open(out_file, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out_file}", file=sys.stderr)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+    else:
+        for scale, timings in results["results"].items():
+            for name, timing in timings.items():
+                if isinstance(timing, dict):
+                    print(f"{scale:>10} {name:<32} {timing['median']:>10.4f}")
+    for scale, timings in results["results"].items():
+        compact = timings["table_memory_mb"]
+        decoded = timings["table_memory_decoded_mb"]
+        print(
+            f"{scale:>10} table memory {compact:.1f} MB, {decoded:.1f} MB decoded "
+            f"({1 - compact / decoded:.0%} saved)"
+        )
+        print(
+            f"{scale:>10} two joined releases {timings['joined_memory_mb']:.1f} MB"
+        )
+    for name, timing in results["startup"].items():
+        if isinstance(timing, dict):
+            print(f"{'startup':>10} {name:<32} {timing['median']:>10.4f}")
+
+    problems = check_startup(results["startup"], args.startup_target)
+    for problem in problems:
+        print(f"Startup check failed: {problem}", file=sys.stderr)
+    return 1 if len(problems) != 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
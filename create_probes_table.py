@@ -15,14 +15,60 @@ Extended RSID - The dbSNP RS ID column was not used because in order to have an
 
 For more information on these columns or others please see the readme file included with the annot.csv file from Thermo's website. 
 
+Usage:
+python create_probes_table.py [annot file] [--version VERSION] [--jobs N] [--previous VERSION] [--sqlite]
+
+The library version names the files written, e.g. pscan_table_r9.csv. It is taken from the annot file name, like r9 from PharmacoScan_96F.na36.r9.a4.annot.csv, unless --version is given. Tables of several versions can be kept side by side and compared with the query tool.
+
+A manifest with a content hash for each Probe Set ID is written next to the table. When --previous is given the table and manifest of that version are patched: only new or changed probe sets are processed, removed ones are dropped and a json changelog of the added, changed and removed Probe Set IDs is written. The patched table is the same as a full rebuild.
+
+With --jobs the annot file is split into byte ranges on line boundaries that are processed in a pool of N processes. The results are merged back in file order so the table is identical to a single process build.
+
+If pyarrow is installed a columnar Feather copy of the table is written next to the csv. The Gene, Chromosome and rsID columns are dictionary encoded and the file is left uncompressed so the query tool can memory map it. The header lines written to the csv are stored in the Feather schema metadata, along with the size and modification time of the csv so that the query tool can tell when a newer csv has replaced the one the Feather file was made from.
+
+A summary of each gene's coverage is written to pscan_gene_summary_[version].csv so the query tool can report how well genes are covered without going through the table. It has one row per gene with the chromosome, the first and last position and span of its variants, and its number of variants, probe sets and probes.
+
+With --sqlite a SQLite database of the table is also written for the query tool's SQLite engine. It has indexes on Gene, rsID and chromosome and position, and the header lines written to the csv are stored in its metadata table.
+
 Author: Andrew Haddad
 Library version: r9
 """
+import argparse
+import io
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
 
 import numpy as np
 import pandas as pd
 
+from app_utils import normalize_chromosome
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+
+cols = [
+    "Probe Set ID",
+    "Chromosome",
+    "Physical Position",
+    "Ref Allele",
+    "Alt Allele",
+    "Associated Gene",
+    "Probe Count",
+    "Extended RSID",
+]
+chunksize = 100000
+# Target size in bytes of each piece of the annot file handed to a worker
+range_size = 32 * 1024 * 1024
+
 
 def split_rsids_col(data):
     # It is possible for multiple rsids to be associated with a variant
@@ -33,38 +79,66 @@ def split_rsids_col(data):
     return data
 
 
-def split_up_data(data):
-    # Need to split the data based on the Associated Gene column.
-    # There are some probesets that are not associated with any
-    # genes and these won't parse out correctly in a later step
-    mod_condition = data["Associated Gene"].str.len() % 7
-    # copy avoids SettingwithCopyWarning
-    no_genes = data.loc[mod_condition != 0].copy()
-    genes = data.loc[mod_condition == 0]
-    return genes, no_genes
-
-
 def split_gene_col(data):
     # The associated gene column contains the following data:
     # "transcript accession // SNP-gene relationship // distance
     # (value 0 if within the gene) // UniGene Cluster ID //
     # gene name or symbol // NCBI Gene ID // GenBank description"
     # A probeset not associated with any gene will return [---]
+    # Multiple genes are separated by /// which leaves 7 fields per gene
+    # after splitting on //. The gene symbol is every 7th field starting
+    # with the 4th index.
+    fields = data["Associated Gene"].str.split("//")
+    # There are some probesets that are not associated with any
+    # genes and these won't split into a multiple of 7 fields
+    has_genes = fields.str.len() % 7 == 0
+    genes = data.loc[has_genes].assign(
+        **{"Associated Gene": fields.loc[has_genes].str[4::7]}
+    )
+    # No gene associated with these rows
+    no_genes = data.loc[~has_genes].assign(**{"Associated Gene": np.nan})
+    genes = genes.explode("Associated Gene", ignore_index=True).drop_duplicates(
+        ignore_index=True
+    )
+    genes["Associated Gene"] = genes["Associated Gene"].str.strip()
+    return genes, no_genes
 
-    data.loc[:, "Associated Gene"] = data["Associated Gene"].str.split("//")
-    return data
 
+def find_column_types(data):
+    # The annot file is read in chunks as strings. This records the type
+    # pandas would have given each column had the whole file been read at
+    # once so that the output is written out the same way.
+    column_types = {}
+    for col in data.columns:
+        try:
+            values = pd.to_numeric(data[col])
+        except (ValueError, TypeError):
+            column_types[col] = "object"
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            column_types[col] = "int64"
+        else:
+            column_types[col] = "float64"
+    return column_types
 
-def explode_and_filter(data):
-    # Explode the gene column that was split
-    # Then take every 7th row starting with the 4th index
-    data = (
-        data.explode("Associated Gene", ignore_index=True)
-        .iloc[4::7]
-        .drop_duplicates(ignore_index=True)
-    )
-    data.loc[:, "Associated Gene"] = data.loc[:, "Associated Gene"].str.strip()
-    return data
+
+def merge_column_types(column_types, chunk_types):
+    for col, chunk_type in chunk_types.items():
+        current = column_types.get(col, chunk_type)
+        if "object" in [current, chunk_type]:
+            column_types[col] = "object"
+        elif "float64" in [current, chunk_type]:
+            column_types[col] = "float64"
+        else:
+            column_types[col] = "int64"
+    return column_types
+
+
+def restore_column_types(data, column_types):
+    numeric_types = {
+        col: col_type for col, col_type in column_types.items() if col_type != "object"
+    }
+    return data.astype(numeric_types)
 
 
 def remove_blank_data(data):
@@ -80,28 +154,217 @@ def remove_blank_data(data):
     return data
 
 
-def _check_row_for_na(df):
-    result = df.dropna(subset=["Associated Gene"])
-    if result.shape[0] == 0:
-        # If the rows consist only of NaNs then we need to keep it
-        return df
-    # Otherwise drop the NaNs
-    return result
-
-
 def remove_na_gene(data):
     # Some gene rows have NaN in the values and need to be dropped
     # These can't be dropped outright because there might not be a gene
     # listed for a particular Probe Set ID
-    data = (
-        data.groupby("Probe Set ID", as_index=False, sort=False)
-        .apply(_check_row_for_na)
-        .reset_index(drop=True)
+    codes, uniques = pd.factorize(data["Probe Set ID"])
+    has_id = codes != -1
+    has_gene = data["Associated Gene"].notna().to_numpy()
+    probe_set_has_gene = np.bincount(
+        codes[has_id], weights=has_gene[has_id], minlength=len(uniques)
     )
+    keep = has_id & (has_gene | (probe_set_has_gene[codes] == 0))
+    data = data.loc[keep]
+    if not np.array_equal(keep, has_id):
+        # Rows end up grouped by Probe Set ID in order of first appearance
+        # whenever any rows were dropped
+        data = data.iloc[np.argsort(codes[keep], kind="stable")]
+    return data.reset_index(drop=True)
+
+
+def create_manifest(chunk):
+    # One content hash per Probe Set ID over every column used from the annot
+    # file. A probe set needs to be rebuilt whenever its hash changes.
+    hashes = pd.util.hash_pandas_object(chunk.loc[:, cols], index=False)
+    return pd.DataFrame(
+        {"Probe Set ID": chunk["Probe Set ID"].to_numpy(), "Hash": hashes.to_numpy()}
+    )
+
+
+def process_chunk(chunk):
+    gene_data, no_gene_data = split_gene_col(chunk)
+    return gene_data, no_gene_data, find_column_types(chunk), create_manifest(chunk)
+
+
+def combine_chunks(results):
+    # Rows with genes come before the rows without any genes
+    gene_parts = []
+    no_gene_parts = []
+    manifest_parts = []
+    column_types = {}
+    for gene_data, no_gene_data, chunk_types, chunk_manifest in results:
+        gene_parts.append(gene_data)
+        no_gene_parts.append(no_gene_data)
+        manifest_parts.append(chunk_manifest)
+        column_types = merge_column_types(column_types, chunk_types)
+    data = pd.concat(gene_parts + no_gene_parts, ignore_index=True, axis=0)
+    manifest = pd.concat(manifest_parts, ignore_index=True)
+    return restore_column_types(data, column_types), column_types, manifest
+
+
+def clean_table(data):
+    data = split_rsids_col(data)
+    data = remove_blank_data(data)
+    data = remove_na_gene(data)
+    data = rename_cols(data)
     return data
 
 
-def write_output(data, out_file):
+def read_chunks(file_path_in, chunksize=chunksize):
+    return pd.read_csv(
+        file_path_in, comment="#", usecols=cols, dtype=str, chunksize=chunksize
+    )
+
+
+def find_data_start(file_path_in):
+    # Returns the header row and the byte offset of the first data row.
+    # Everything before the header row is a # comment line
+    with open(file_path_in, "rb") as f:
+        for line in f:
+            if not line.startswith(b"#"):
+                return line, f.tell()
+    return b"", os.path.getsize(file_path_in)
+
+
+def split_byte_ranges(file_path_in, start, pieces):
+    # Splits the data rows into byte ranges that always end on a line break.
+    # Assumes that no quoted field in the annot file spans multiple lines
+    size = os.path.getsize(file_path_in)
+    step = max((size - start) // pieces, 1)
+    ranges = []
+    with open(file_path_in, "rb") as f:
+        while start < size:
+            f.seek(min(start + step, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def process_byte_range(file_path_in, header, start, end, chunksize=chunksize):
+    with open(file_path_in, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    chunks = read_chunks(io.BytesIO(header + data), chunksize)
+    return [process_chunk(chunk) for chunk in chunks]
+
+
+def build_table(file_path_in, chunksize=chunksize, jobs=1):
+    # The annot file is processed in chunks so only the columns that are
+    # kept and the parsed gene symbols for each chunk are held in memory.
+    # Returns the table along with the column types and the manifest
+    # needed for a later incremental rebuild.
+    if jobs == 1:
+        chunks = read_chunks(file_path_in, chunksize)
+        results = (process_chunk(chunk) for chunk in chunks)
+        data, column_types, manifest = combine_chunks(results)
+        return clean_table(data), column_types, manifest
+
+    # Each worker handles byte ranges of the file. The results come back in
+    # file order so the merged table is the same as with a single process.
+    header, start = find_data_start(file_path_in)
+    pieces = max(jobs, (os.path.getsize(file_path_in) - start) // range_size)
+    starts, ends = zip(*split_byte_ranges(file_path_in, start, pieces))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        range_results = executor.map(
+            process_byte_range,
+            repeat(file_path_in),
+            repeat(header),
+            starts,
+            ends,
+            repeat(chunksize),
+        )
+        results = [result for chunks in range_results for result in chunks]
+    data, column_types, manifest = combine_chunks(results)
+    return clean_table(data), column_types, manifest
+
+
+def read_table_text(file_path):
+    # Reads a table back exactly as it was written so that rows can be
+    # written out again without any change to their text
+    return pd.read_csv(file_path, comment="#", dtype=str, keep_default_na=False)
+
+
+class FullRebuildNeeded(Exception):
+    """Raised by rebuild_table when the previous table can't be patched."""
+
+
+def rebuild_table(file_path_in, previous_table, previous_manifest, chunksize=chunksize):
+    # Only the probe sets that were added or whose annot rows changed since
+    # the previous table are run through the pipeline. The rows for the
+    # remaining probe sets are copied from the previous table.
+    # Raises FullRebuildNeeded with the reason when the whole table needs to
+    # be built instead.
+    old_manifest, old_column_types = read_manifest(previous_manifest)
+    old_ids = pd.Index(old_manifest["Probe Set ID"])
+    old_hashes = old_manifest["Hash"].to_numpy()
+    if not old_ids.is_unique:
+        raise FullRebuildNeeded(
+            "The previous manifest lists some Probe Set IDs more than once"
+        )
+
+    manifest_parts = []
+    gene_row_parts = []
+    rebuild_parts = []
+    column_types = {}
+    for chunk in read_chunks(file_path_in, chunksize):
+        chunk_manifest = create_manifest(chunk)
+        positions = old_ids.get_indexer(chunk_manifest["Probe Set ID"])
+        hashes = chunk_manifest["Hash"].to_numpy()
+        rebuild = (positions == -1) | (old_hashes[positions] != hashes)
+        rebuild_parts.append(chunk.loc[rebuild])
+        manifest_parts.append(chunk_manifest.assign(Status=np.where(
+            positions == -1, "added", np.where(rebuild, "changed", "unchanged")
+        )))
+        fields = chunk["Associated Gene"].str.split("//")
+        gene_row_parts.append((fields.str.len() % 7 == 0).to_numpy())
+        column_types = merge_column_types(column_types, find_column_types(chunk))
+    manifest = pd.concat(manifest_parts, ignore_index=True)
+    if column_types != old_column_types:
+        # Values would be written out differently than in the previous table
+        raise FullRebuildNeeded("Column types changed since the previous table")
+    if not manifest["Probe Set ID"].is_unique:
+        raise FullRebuildNeeded(
+            "The annot file lists some Probe Set IDs more than once"
+        )
+
+    rebuild = pd.concat(rebuild_parts, ignore_index=True)
+    gene_data, no_gene_data = split_gene_col(rebuild)
+    new_rows = pd.concat([gene_data, no_gene_data], ignore_index=True, axis=0)
+    new_rows = clean_table(restore_column_types(new_rows, column_types))
+    new_rows = pd.read_csv(
+        io.StringIO(new_rows.to_csv(index=False)), dtype=str, keep_default_na=False
+    )
+    old_rows = read_table_text(previous_table)
+    unchanged = manifest.loc[manifest["Status"] == "unchanged", "Probe Set ID"]
+    old_rows = old_rows.loc[old_rows["Probe Set ID"].isin(unchanged)]
+
+    # Each probe set's rows only depend on its own annot row. In a full
+    # build the probe sets with genes come first followed by those without,
+    # both in annot file order.
+    gene_rows = np.concatenate(gene_row_parts)
+    order = pd.Index(
+        pd.concat(
+            [manifest["Probe Set ID"][gene_rows], manifest["Probe Set ID"][~gene_rows]]
+        )
+    )
+    data = pd.concat([old_rows, new_rows], ignore_index=True)
+    data = data.iloc[
+        np.argsort(order.get_indexer(data["Probe Set ID"]), kind="stable")
+    ].reset_index(drop=True)
+
+    removed = old_ids[~old_ids.isin(manifest["Probe Set ID"])]
+    changes = {
+        status: manifest.loc[manifest["Status"] == status, "Probe Set ID"].tolist()
+        for status in ["added", "changed"]
+    }
+    changes["removed"] = removed.tolist()
+    return data, column_types, manifest.drop(columns="Status"), changes
+
+
+def create_header():
     date = datetime.today()
     lines_to_write = [
         "Pharmacoscan query file",
@@ -110,12 +373,160 @@ def write_output(data, out_file):
         f"Date Created: {date.strftime('%B')} {date.day}, {date.year}",
         f"Library version number: {version}",
     ]
+    return lines_to_write
+
+
+def write_output(data, out_file, header):
     with open(out_file, "w") as f:
-        for line in lines_to_write:
+        for line in header:
             f.write(f"#{line}\n")
     data.to_csv(out_file, index=False, mode="a")
 
 
+def write_feather(csv_file, out_file, header):
+    # The csv is read back in the same way the query tool reads it so both
+    # files load into identical tables
+    data = pd.read_csv(csv_file, comment="#")
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    for col in ["Gene", "Chromosome", "rsID"]:
+        i = table.schema.get_field_index(col)
+        table = table.set_column(i, col, table.column(col).dictionary_encode())
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"pscan_query"] = json.dumps(header).encode()
+    # The query tool only uses the Feather file while the csv still matches
+    stat = os.stat(csv_file)
+    metadata[b"pscan_query_source"] = json.dumps(
+        {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    ).encode()
+    table = table.replace_schema_metadata(metadata)
+    # Left uncompressed so that the file can be memory mapped
+    feather.write_feather(table, out_file, compression="uncompressed")
+
+
+def _sqlite_type(dtype):
+    if pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def write_sqlite(csv_file, out_file, header):
+    # The csv is read back in the same way the query tool reads it so both
+    # engines answer queries from identical tables. row_id is the row's
+    # position in the csv, which the query tool orders results by
+    data = pd.read_csv(csv_file, comment="#").astype({"Position": "Int64"})
+    chromosomes = data["Chromosome"]
+    if pd.api.types.is_numeric_dtype(chromosomes):
+        chromosomes = chromosomes.astype("Int64")
+    data["chromosome_key"] = [
+        None if pd.isna(chromosome) else normalize_chromosome(chromosome)
+        for chromosome in chromosomes.astype(object)
+    ]
+    columns = ", ".join(
+        f'"{col}" {_sqlite_type(dtype)}' for col, dtype in data.dtypes.items()
+    )
+    # Numeric columns are read back as these types so results match the csv
+    dtypes = {
+        col: str(dtype)
+        for col, dtype in data.dtypes.items()
+        if pd.api.types.is_numeric_dtype(dtype)
+    }
+
+    # Written under a temporary name so a running query tool never opens a
+    # partly written database
+    temp_file = out_file + ".tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    conn = sqlite3.connect(temp_file)
+    try:
+        conn.execute(f"CREATE TABLE probes (row_id INTEGER PRIMARY KEY, {columns})")
+        data.to_sql(
+            "probes", conn, if_exists="append", index=True, index_label="row_id"
+        )
+        conn.execute("CREATE INDEX probes_gene ON probes (Gene)")
+        conn.execute("CREATE INDEX probes_rsid ON probes (rsID)")
+        conn.execute(
+            "CREATE INDEX probes_position ON probes (chromosome_key, Position)"
+        )
+        conn.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany(
+            "INSERT INTO metadata VALUES (?, ?)",
+            [("header", json.dumps(header)), ("dtypes", json.dumps(dtypes))],
+        )
+        conn.commit()
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    os.replace(temp_file, out_file)
+
+
+def summarize_genes(csv_file):
+    # The csv is read back in the same way the query tool reads it. The
+    # table has a row per gene and rsID so probe sets and variants can be
+    # listed more than once for the same gene
+    data = pd.read_csv(csv_file, comment="#")
+    data = data.loc[data["Gene"].notna()]
+    chromosomes = data["Chromosome"]
+    if pd.api.types.is_numeric_dtype(chromosomes):
+        chromosomes = chromosomes.astype("Int64")
+    data = data.assign(Chromosome=chromosomes.astype(object))
+    genes = data.groupby("Gene", sort=True)
+    positions = genes["Position"]
+    summary = pd.DataFrame(
+        {
+            "Chromosome": genes["Chromosome"].agg(
+                lambda values: ",".join(map(str, values.dropna().unique()))
+            ),
+            "Start": positions.min(),
+            "End": positions.max(),
+        }
+    ).astype({"Start": "Int64", "End": "Int64"})
+    summary["Span"] = summary["End"] - summary["Start"] + 1
+    variants = data.drop_duplicates(["Gene", "Chromosome", "Position", "Ref", "Alt"])
+    summary["Variants"] = variants.groupby("Gene").size()
+    probe_sets = data.drop_duplicates(["Gene", "Probe Set ID"]).groupby("Gene")
+    summary["Probe Sets"] = probe_sets.size()
+    summary["Probe Count"] = (
+        probe_sets["Probe Count"].sum(min_count=1).astype("Int64")
+    )
+    return summary.reset_index()
+
+
+def write_manifest(manifest, column_types, out_file, header):
+    with open(out_file, "w") as f:
+        for line in header:
+            f.write(f"#{line}\n")
+        f.write(f"#Column types: {json.dumps(column_types)}\n")
+    manifest.to_csv(out_file, index=False, mode="a")
+
+
+def read_manifest(manifest_file):
+    column_types = {}
+    with open(manifest_file, "r") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            if line.startswith("#Column types: "):
+                column_types = json.loads(line[len("#Column types: ") :])
+    manifest = pd.read_csv(
+        manifest_file, comment="#", dtype={"Probe Set ID": str, "Hash": "uint64"}
+    )
+    return manifest, column_types
+
+
+def write_changelog(changes, out_file, previous_version):
+    changelog = {
+        "annot_file": file_path_in,
+        "previous_version": previous_version,
+        "version": version,
+        "counts": {status: len(ids) for status, ids in changes.items()},
+        **changes,
+    }
+    with open(out_file, "w") as f:
+        json.dump(changelog, f, indent=2)
+
+
 def rename_cols(data):
     new_names = [
         "Probe Set ID",
@@ -131,29 +542,105 @@ def rename_cols(data):
     return data
 
 
-if __name__ == "__main__":
-    cols = [
-        "Probe Set ID",
-        "Chromosome",
-        "Physical Position",
-        "Ref Allele",
-        "Alt Allele",
-        "Associated Gene",
-        "Probe Count",
-        "Extended RSID",
-    ]
-    file_path_in = "PharmacoScan_96F.na36.r9.a4.annot.csv"
-    version = "r9"
-    data = pd.read_csv(file_path_in, comment="#", usecols=cols)
-    data = split_gene_col(data)
-    gene_data, no_gene_data = split_up_data(data)
-    # No gene associated with these rows
-    no_gene_data.loc[:, "Associated Gene"] = np.nan
-    gene_data = explode_and_filter(gene_data)
-    data = pd.concat([gene_data, no_gene_data], ignore_index=True, axis=0)
-    data = split_rsids_col(data)
+def find_version(file_path):
+    # Annot files are named like PharmacoScan_96F.na36.r9.a4.annot.csv
+    match = re.search(r"\.(r\d+)\.", os.path.basename(file_path))
+    if match is None:
+        return None
+    return match.group(1)
 
-    data = remove_blank_data(data)
-    data = remove_na_gene(data)
-    data = rename_cols(data)
-    write_output(data, f"pscan_table_{version}.csv")
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Create the pharmacoscan query table from an annot file."
+    )
+    parser.add_argument(
+        "annot",
+        nargs="?",
+        default="PharmacoScan_96F.na36.r9.a4.annot.csv",
+        help="Annot csv file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--version",
+        help="Library version (default: taken from the annot file name, e.g. r9)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to read the annot file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--previous",
+        metavar="VERSION",
+        help=(
+            "Patch the table and manifest of a previous version instead of "
+            "building from scratch"
+        ),
+    )
+    parser.add_argument(
+        "--sqlite",
+        action="store_true",
+        help="Also write the table as a SQLite database for the SQLite query engine",
+    )
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.version is None:
+        args.version = find_version(args.annot)
+        if args.version is None:
+            parser.error(
+                "Unable to find the library version in the annot file name. "
+                "Use --version"
+            )
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    file_path_in = args.annot
+    version = args.version
+    result = None
+    if args.previous is not None:
+        if args.jobs > 1:
+            # Patching only hashes the annot file, which is done in one process
+            print("--jobs is only used if the whole table has to be rebuilt.")
+        try:
+            result = rebuild_table(
+                file_path_in,
+                f"pscan_table_{args.previous}.csv",
+                f"pscan_table_{args.previous}.manifest.csv",
+            )
+        except FullRebuildNeeded as ex:
+            print(f"{ex}. Rebuilding the whole table.")
+    if result is not None:
+        data, column_types, manifest, changes = result
+        write_changelog(
+            changes, f"pscan_table_{version}.changes.json", args.previous
+        )
+        print(
+            f"Added: {len(changes['added'])} Changed: {len(changes['changed'])} "
+            f"Removed: {len(changes['removed'])}"
+        )
+    else:
+        data, column_types, manifest = build_table(file_path_in, jobs=args.jobs)
+    header = create_header()
+    write_output(data, f"pscan_table_{version}.csv", header)
+    write_manifest(
+        manifest, column_types, f"pscan_table_{version}.manifest.csv", header
+    )
+    write_output(
+        summarize_genes(f"pscan_table_{version}.csv"),
+        f"pscan_gene_summary_{version}.csv",
+        header,
+    )
+    if pa is not None:
+        write_feather(
+            f"pscan_table_{version}.csv", f"pscan_table_{version}.feather", header
+        )
+    else:
+        print("pyarrow is not installed. Skipping the Feather table.")
+    if args.sqlite:
+        write_sqlite(
+            f"pscan_table_{version}.csv", f"pscan_table_{version}.sqlite", header
+        )
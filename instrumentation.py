@@ -0,0 +1,181 @@
+"""
+Lightweight per-stage instrumentation for queries.
+
+A QueryStats object is passed along with a query and each stage of the query
+(reading the input file, loading the table, filtering, rendering and
+exporting) is wrapped in stats.stage(). Every stage records its wall time,
+the rows going in and out, the peak memory of the process when it finished
+(process_peak_mb) and how far the stage raised that peak (peak_increase_mb).
+The process peak covers everything the process has done since it started, so
+only peak_increase_mb is down to the stage itself. It is 0 when the stage
+stayed below an earlier peak, and stages running at the same time on other
+threads add to each other's increase. Only a clock read and two calls for the
+process's peak memory are done per stage so this can be left on all the time.
+
+Setting the PSCAN_QUERY_STAGE_LOG environment variable to a file path, or
+calling set_log_file(), appends every finished query to that file as one line
+of JSON. Setting profile_path on a QueryStats object runs the code inside
+stats.profiling() under cProfile and dumps the profile to that path.
+"""
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+_log_file = os.environ.get("PSCAN_QUERY_STAGE_LOG")
+_log_lock = threading.Lock()
+
+
+def set_log_file(file_path):
+    global _log_file
+    _log_file = file_path
+
+
+def peak_memory_mb():
+    # Peak resident memory of the process so far. None if it can't be found
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_memory_mb()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # macOS reports bytes while Linux reports kilobytes
+        return peak / 1024 ** 2
+    return peak / 1024
+
+
+def _windows_peak_memory_mb():
+    try:
+        import ctypes
+        from ctypes import wintypes
+    except ImportError:
+        return None
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    try:
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(
+            process, ctypes.byref(counters), counters.cb
+        ):
+            return None
+    except (AttributeError, OSError):
+        return None
+    return counters.PeakWorkingSetSize / 1024 ** 2
+
+
+class QueryStats:
+    """Timings for each stage of one query.
+
+    stage() yields a dict for the stage so the code inside the block can fill
+    in rows_out once it knows it.
+    """
+
+    def __init__(self, name, **info):
+        self.name = name
+        self.info = info
+        self.stages = []
+        self.profile_path = None
+        self.started = datetime.now()
+
+    @contextmanager
+    def stage(self, stage, rows_in=None):
+        record = {"stage": stage, "rows_in": rows_in, "rows_out": None}
+        peak_before = peak_memory_mb()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            peak = peak_memory_mb()
+            record["process_peak_mb"] = peak
+            record["peak_increase_mb"] = (
+                None if peak is None or peak_before is None else peak - peak_before
+            )
+            self.stages.append(record)
+
+    @contextmanager
+    def profiling(self):
+        if self.profile_path is None:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self.profile_path)
+
+    @property
+    def total_seconds(self):
+        return sum(record["seconds"] for record in self.stages)
+
+    def summary(self):
+        parts = []
+        for record in self.stages:
+            text = f"{record['stage']} {record['seconds']:.3f}s"
+            if record.get("cache") == "hit":
+                text += " cached"
+            if record["rows_in"] is not None and record["rows_out"] is not None:
+                text += f" ({record['rows_in']}->{record['rows_out']} rows)"
+            elif record["rows_out"] is not None:
+                text += f" ({record['rows_out']} rows)"
+            if record["peak_increase_mb"]:
+                text += f" +{record['peak_increase_mb']:.0f} MB"
+            parts.append(text)
+        peaks = [r["process_peak_mb"] for r in self.stages if r["process_peak_mb"]]
+        if len(peaks) != 0:
+            parts.append(f"process peak {max(peaks):.0f} MB")
+        return " | ".join(parts)
+
+    def to_dict(self):
+        return {
+            "time": self.started.isoformat(timespec="seconds"),
+            "name": self.name,
+            **self.info,
+            "total_seconds": self.total_seconds,
+            "stages": self.stages,
+            "profile": self.profile_path,
+        }
+
+    def finish(self):
+        # Appends the query to the stage log when one is set
+        if _log_file is None:
+            return
+        line = json.dumps(self.to_dict())
+        with _log_lock:
+            with open(_log_file, "a") as f:
+                f.write(line + "\n")
+
+
+class NullStats(QueryStats):
+    """Stand-in used when the caller doesn't want any stats kept."""
+
+    def __init__(self):
+        super().__init__(None)
+
+    @contextmanager
+    def stage(self, stage, rows_in=None):
+        yield {}
+
+    def finish(self):
+        pass
@@ -0,0 +1,293 @@
+"""
+Command line interface for the pharmacoscan query tool.
+
+Runs the same queries as the GUI without needing a display. IDs are read and
+queried in chunks and the results are written out as each chunk finishes, so
+memory use stays bounded no matter how many IDs are in the input.
+
+Examples:
+python -m pscan_query --rsid-file ids.txt --out results.tsv
+python -m pscan_query --genes CYP2D6,CYP2C19 --format csv
+cat regions.bed | python -m pscan_query --region-file - --out results.xlsx
+python -m pscan_query --panel-file panels.tsv --out panels.xlsx
+python -m pscan_query --genes CYP2D6 --compare r8,r9 --out changes.tsv
+
+Panels are read from a file of panel<TAB>ID lines or from a directory with a
+file of IDs per panel. All the panels are queried together and the coverage
+summary of each panel is written to a second sheet of xlsx files, next to
+csv/tsv files as <name>.summary.<ext>, or to stderr when writing to stdout.
+
+--compare queries several releases of the table side by side, giving an On
+Array column per release and whether each row was added, removed or changed
+between consecutive releases. Releases are named by their version, e.g. r9
+for pscan_table_r9.csv.
+
+Exit codes:
+0 - Query ran and the results were written
+1 - No IDs could be parsed from the input
+2 - Invalid command line arguments
+3 - The input file could not be read
+4 - The pharmacoscan table could not be loaded
+5 - The output could not be written
+"""
+import argparse
+import itertools
+import os
+import sys
+
+import app_utils
+from app_utils import (
+    ParseReport,
+    ResultWriter,
+    compare_releases,
+    export_format,
+    iter_ids,
+    query_panels,
+    query_table,
+    read_panels,
+)
+
+EXIT_OK = 0
+EXIT_NO_IDS = 1
+EXIT_USAGE = 2
+EXIT_INPUT_ERROR = 3
+EXIT_TABLE_ERROR = 4
+EXIT_OUTPUT_ERROR = 5
+
+
+def _chunks(ids, chunk_size):
+    # iter_ids only yields each ID once so no rows are repeated across chunks
+    while True:
+        chunk = list(itertools.islice(ids, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+class _InputError(Exception):
+    pass
+
+
+class _TableError(Exception):
+    pass
+
+
+def _read_ids(lines, data_type, report):
+    # Read errors are raised while iterating so they are wrapped here to tell
+    # them apart from errors writing the output
+    try:
+        yield from iter_ids(lines, data_type, report)
+    except (OSError, UnicodeDecodeError) as ex:
+        raise _InputError(ex) from ex
+
+
+def _open_input(file_path):
+    if file_path == "-":
+        return sys.stdin
+    return open(file_path, "r")
+
+
+def _find_format(args):
+    if args.format is not None:
+        return args.format
+    if args.out is None or args.out == "-":
+        return "tsv"
+    # All other extensions are written as tab delimited files like in the GUI
+    return export_format(args.out)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pscan_query",
+        description="Query the pharmacoscan table by gene, rsID, region or allele.",
+    )
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("--genes", help="Comma separated genes to query")
+    query.add_argument("--rsids", help="Comma separated rsIDs to query")
+    query.add_argument("--regions", help="Comma separated chr:start-end regions")
+    query.add_argument("--gene-file", help="File of genes. Use - for stdin")
+    query.add_argument("--rsid-file", help="File of rsIDs. Use - for stdin")
+    query.add_argument(
+        "--region-file", help="BED or chr:start-end file. Use - for stdin"
+    )
+    query.add_argument("--alleles", help="Comma separated alleles like CYP2C19*2")
+    query.add_argument("--allele-file", help="File of alleles. Use - for stdin")
+    query.add_argument(
+        "--panel-file",
+        help="File of panel<TAB>ID lines or a directory with a file per panel",
+    )
+    parser.add_argument(
+        "--out",
+        help="Output file, gzipped if it ends in .gz. Results are written to "
+        "stdout if not given",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["csv", "tsv", "xlsx"],
+        help="Output format. Defaults to the --out extension or tsv",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Number of IDs queried at a time (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--table", help="Pharmacoscan table to query instead of the default"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["pandas", "sqlite"],
+        help="Query the table held in memory or the SQLite table written by "
+        "create_probes_table.py --sqlite. Defaults to $PSCAN_QUERY_ENGINE or pandas",
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="VERSIONS",
+        help="Comma separated releases to compare side by side, oldest first, "
+        "e.g. r8,r9. Only genes, rsIDs and regions can be compared",
+    )
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if _find_format(args) == "xlsx" and (args.out is None or args.out == "-"):
+        parser.error("xlsx output can't be written to stdout. Use --out")
+    if args.compare is not None:
+        args.compare = [
+            version.strip() for version in args.compare.split(",") if version.strip()
+        ]
+        if len(set(args.compare)) < 2:
+            parser.error("--compare needs at least two releases")
+        if any(
+            value is not None
+            for value in [args.panel_file, args.alleles, args.allele_file]
+        ):
+            parser.error("--compare can only be used with genes, rsIDs or regions")
+        if args.table is not None:
+            # Each release is read from pscan_table_<version>.csv
+            parser.error("--table can't be used with --compare")
+    return args
+
+
+def _run_panels(args, file_format):
+    # Panels are queried all at once instead of in chunks so that each type
+    # of ID is only looked up once
+    report = ParseReport()
+    panels, error = read_panels(args.panel_file, report)
+    if error is not None:
+        print(f"Unable to read panels: {error.__name__}", file=sys.stderr)
+        return EXIT_INPUT_ERROR
+    print(f"Parsed panel IDs: {report.summary()}", file=sys.stderr)
+    if panels is None:
+        print("No IDs could be parsed from the input", file=sys.stderr)
+        return EXIT_NO_IDS
+    try:
+        results, summary = query_panels(panels)
+    except (OSError, ValueError) as ex:
+        # e.g. a panel has alleles but there are no allele definitions
+        print(f"Unable to query panels: {ex}", file=sys.stderr)
+        return EXIT_TABLE_ERROR
+    try:
+        writer = ResultWriter(args.out, file_format)
+        writer.write(results)
+        if args.out is None or args.out == "-":
+            summary.to_csv(sys.stderr, sep="\t", index=False)
+        else:
+            writer.write_summary(summary)
+        writer.close()
+    except OSError as ex:
+        print(f"Unable to write output: {ex}", file=sys.stderr)
+        return EXIT_OUTPUT_ERROR
+    return EXIT_OK
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    file_format = _find_format(args)
+    if args.engine is not None:
+        app_utils.query_engine = args.engine
+    if args.table is not None:
+        table = os.path.abspath(args.table)
+        if app_utils.query_engine == "sqlite":
+            app_utils.sqlite_store = app_utils.SqliteStore(table)
+        else:
+            app_utils.table_store = app_utils.TableStore(table)
+
+    for data_type in ["gene", "rsid", "region", "allele"]:
+        text = getattr(args, f"{data_type}s")
+        file_path = getattr(args, f"{data_type}_file")
+        if text is not None or file_path is not None:
+            break
+
+    try:
+        if args.compare is not None:
+            app_utils.release_store.get(args.compare)
+        else:
+            app_utils.get_store().warm()
+    except Exception as ex:
+        print(f"Unable to load the pharmacoscan table: {ex}", file=sys.stderr)
+        return EXIT_TABLE_ERROR
+    if data_type == "allele" and args.panel_file is None:
+        try:
+            app_utils.allele_store.get(app_utils.get_store().get())
+        except (OSError, ValueError) as ex:
+            print(f"Unable to load the allele definitions: {ex}", file=sys.stderr)
+            return EXIT_TABLE_ERROR
+    if args.panel_file is not None:
+        return _run_panels(args, file_format)
+
+    f = None
+    try:
+        if text is not None:
+            # Region positions can have thousands separators so regions are
+            # split up by parse_region_text instead
+            lines = [text] if data_type == "region" else text.split(",")
+        else:
+            f = _open_input(file_path)
+            lines = f
+        report = ParseReport()
+        ids = _read_ids(lines, data_type, report)
+
+        try:
+            # The output is only created once there are IDs to query so
+            # nothing is left behind when none can be parsed
+            writer = None
+            chunk_count = 0
+            for chunk in _chunks(ids, args.chunk_size):
+                # Query errors are wrapped so only errors writing the output
+                # are reported as such below
+                try:
+                    if args.compare is not None:
+                        results = compare_releases(chunk, args.compare, data_type)
+                    else:
+                        results = query_table(chunk, data_type)
+                except (OSError, ValueError) as ex:
+                    raise _TableError(ex) from ex
+                if writer is None:
+                    writer = ResultWriter(args.out, file_format)
+                writer.write(results)
+                chunk_count += 1
+            if writer is not None:
+                writer.close()
+        except OSError as ex:
+            print(f"Unable to write output: {ex}", file=sys.stderr)
+            return EXIT_OUTPUT_ERROR
+    except (OSError, UnicodeDecodeError, _InputError) as ex:
+        print(f"Unable to read input file: {ex}", file=sys.stderr)
+        return EXIT_INPUT_ERROR
+    except _TableError as ex:
+        print(f"Unable to query the pharmacoscan table: {ex}", file=sys.stderr)
+        return EXIT_TABLE_ERROR
+    finally:
+        if f is not None and f is not sys.stdin:
+            f.close()
+
+    print(f"Parsed {data_type} IDs: {report.summary()}", file=sys.stderr)
+    if chunk_count == 0:
+        print("No IDs could be parsed from the input", file=sys.stderr)
+        return EXIT_NO_IDS
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Local query server for the pharmacoscan query tool.
+
+Keeps the pharmacoscan table and its indexes loaded in one long running
+process and answers gene, rsID, region and allele queries over HTTP with JSON
+bodies. This avoids every script paying for starting Python, importing pandas
+and loading the table just to answer one query. Identical queries that arrive
+while one is already running share its result instead of being run again.
+
+Usage:
+python query_server.py [--host 127.0.0.1] [--port 8765] [--table path]
+    [--engine pandas|sqlite]
+
+Endpoints:
+GET  /health - {"status": "ok", "rows": <rows in the table>, "cache": {...}}
+POST /query  - {"ids": [...], "type": "gene" | "rsid" | "region" | "allele"}
+POST /batch  - {"queries": [{"ids": [...], "type": ...}, ...]}
+
+type is optional and is worked out from the first ID when left out. Each
+result is returned as {"type": ..., "columns": [...], "rows": [[...], ...]}.
+
+Scripts can use QueryClient instead of building the requests themselves:
+
+client = QueryClient("127.0.0.1", 8765)
+df = client.query(["CYP2D6", "CYP2C19"])
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request as urllib_request
+
+import app_utils
+from app_utils import find_data_type, iter_ids, query_table
+
+max_body_size = 64 * 1024 * 1024
+reasons = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _result_to_json(df, data_type):
+    # to_json takes care of writing NaN and <NA> as null
+    result = json.loads(df.to_json(orient="split", index=False))
+    return {"type": data_type, "columns": result["columns"], "rows": result["data"]}
+
+
+def _normalize_query(query):
+    # Queries are normalized the same way input files are so that requests
+    # for the same IDs written differently share a single result
+    if not isinstance(query, dict) or not isinstance(query.get("ids"), list):
+        raise RequestError(400, "Each query needs a list of ids")
+    ids = [str(id_) for id_ in query["ids"]]
+    data_type = query.get("type")
+    if data_type is None and len(ids) != 0:
+        data_type = find_data_type(ids)
+    if data_type not in ["gene", "rsid", "region", "allele"]:
+        raise RequestError(400, f"Unknown query type: {data_type}")
+    return data_type, tuple(iter_ids(ids, data_type))
+
+
+class QueryServer:
+    """asyncio HTTP server answering queries against the shared table.
+
+    Queries run in a thread pool so the event loop keeps accepting requests
+    while pandas is working. Running queries are tracked by their normalized
+    IDs and type so identical requests are coalesced onto one future.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, workers=4):
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.in_flight = {}
+        self.server = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # The first query shouldn't have to wait for the table to load
+        await loop.run_in_executor(self.executor, app_utils.get_store().warm)
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port
+        )
+        # Picks up the port the OS chose when started with port 0
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def run_query(self, data_type, ids):
+        key = (data_type, ids)
+        future = self.in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self._query, data_type, ids)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def _query(data_type, ids):
+        if len(ids) == 0:
+            return {"type": data_type, "columns": [], "rows": []}
+        return _result_to_json(query_table(list(ids), data_type), data_type)
+
+    async def handle_request(self, method, path, body):
+        if path == "/health":
+            if method != "GET":
+                raise RequestError(405, "Use GET for /health")
+            # Loading the table can take a while after a cold start or a
+            # change to the file so is kept off the event loop
+            loop = asyncio.get_running_loop()
+            table = await loop.run_in_executor(
+                self.executor, app_utils.get_store().get
+            )
+            return {
+                "status": "ok",
+                "rows": table.row_count,
+                "cache": app_utils.query_cache.info(),
+            }
+        if path not in ["/query", "/batch"]:
+            raise RequestError(404, f"Unknown path: {path}")
+        if method != "POST":
+            raise RequestError(405, f"Use POST for {path}")
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise RequestError(400, "Request body is not valid JSON") from None
+        if path == "/query":
+            return await self.run_query(*_normalize_query(payload))
+        queries = payload.get("queries") if isinstance(payload, dict) else None
+        if not isinstance(queries, list):
+            raise RequestError(400, "A batch needs a list of queries")
+        queries = [_normalize_query(query) for query in queries]
+        results = await asyncio.gather(*[self.run_query(*q) for q in queries])
+        return {"results": results}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode().split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in [b"\r\n", b"\n", b""]:
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if version == "HTTP/1.0":
+                    keep_alive = headers.get("connection", "").lower() == "keep-alive"
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length > max_body_size:
+                        keep_alive = False
+                        raise RequestError(413, "Request body is too large")
+                    body = await reader.readexactly(length)
+                    status = 200
+                    response = await self.handle_request(
+                        method, target.split("?")[0], body
+                    )
+                except RequestError as ex:
+                    status = ex.status
+                    response = {"error": str(ex)}
+                except asyncio.IncompleteReadError:
+                    # The client went away part way through sending the body
+                    raise
+                except Exception as ex:
+                    status = 500
+                    response = {"error": f"{type(ex).__name__}: {ex}"}
+
+                data = json.dumps(response).encode()
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode()
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class QueryClient:
+    """Small client for a running QueryServer.
+
+    Results come back as DataFrames with the same columns query_table
+    returns.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, timeout=60):
+        self.url = f"http://{host}:{port}"
+        self.timeout = timeout
+
+    def _request(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode()
+        req = urllib_request.Request(
+            self.url + path,
+            data=data,
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib_request.urlopen(req, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    @staticmethod
+    def _to_frame(result):
+        import pandas as pd
+
+        return pd.DataFrame(result["rows"], columns=result["columns"])
+
+    def health(self):
+        return self._request("/health")
+
+    def query(self, ids, data_type=None):
+        result = self._request("/query", {"ids": list(ids), "type": data_type})
+        return self._to_frame(result)
+
+    def batch(self, queries):
+        # queries is a list of ID lists or of (ids, data_type) tuples
+        payload = []
+        for query in queries:
+            if isinstance(query, tuple):
+                ids, data_type = query
+            else:
+                ids, data_type = query, None
+            payload.append({"ids": list(ids), "type": data_type})
+        results = self._request("/batch", {"queries": payload})["results"]
+        return [self._to_frame(result) for result in results]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve pharmacoscan queries over HTTP from a warm table."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Threads used to run queries (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--table", help="Pharmacoscan table to query instead of the default"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["pandas", "sqlite"],
+        help="Query the table held in memory or the SQLite table written by "
+        "create_probes_table.py --sqlite. Defaults to $PSCAN_QUERY_ENGINE or pandas",
+    )
+    return parser.parse_args(argv)
+
+
+async def _serve(args):
+    server = QueryServer(args.host, args.port, args.workers)
+    await server.start()
+    print(f"Serving pharmacoscan queries on http://{args.host}:{server.port}")
+    await server.serve_forever()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.engine is not None:
+        app_utils.query_engine = args.engine
+    if args.table is not None:
+        table = os.path.abspath(args.table)
+        if app_utils.query_engine == "sqlite":
+            app_utils.sqlite_store = app_utils.SqliteStore(table)
+        else:
+            app_utils.table_store = app_utils.TableStore(table)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
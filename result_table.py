@@ -0,0 +1,128 @@
+from tkinter import *
+from tkinter import ttk
+
+
+class ResultTable(Frame):
+    """Treeview for query results that only holds the rows in view.
+
+    The results frame is kept as is and only the rows that fit in the
+    Treeview are inserted into it. Scrolling moves a window over the frame and
+    swaps the rows in place, so the time taken to show results doesn't depend
+    on how many rows were returned. Clicking a column heading sorts the frame
+    itself rather than the widget.
+    """
+
+    def __init__(self, master, height=10):
+        super().__init__(master)
+        self.height = height
+        self.df = None
+        self.first_row = 0
+        self.sort_column = None
+        self.sort_ascending = True
+
+        self.tree = ttk.Treeview(self, height=height, show="headings")
+        self.tree.grid(row=0, column=0)
+        self.scroll = ttk.Scrollbar(self, command=self.yview)
+        self.scroll.grid(row=0, column=1, sticky="nsew")
+
+        # Windows and macOS send <MouseWheel>, X11 sends buttons 4 and 5
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_rows(-1))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_rows(1))
+        self.tree.bind("<Up>", lambda event: self.scroll_rows(-1))
+        self.tree.bind("<Down>", lambda event: self.scroll_rows(1))
+        self.tree.bind("<Prior>", lambda event: self.scroll_rows(-self.height))
+        self.tree.bind("<Next>", lambda event: self.scroll_rows(self.height))
+
+    @property
+    def row_count(self):
+        if self.df is None:
+            return 0
+        return self.df.shape[0]
+
+    def show(self, df):
+        self.df = df
+        self.first_row = 0
+        self.sort_column = None
+        self.sort_ascending = True
+        self.tree.configure(columns=df.columns.tolist())
+        for column in df.columns:
+            width = 100
+            if column == "Ref" or column == "Alt":
+                width = 40
+            self.tree.column(column, anchor=CENTER, width=width, stretch=NO)
+            self.tree.heading(
+                column,
+                text=column,
+                anchor=CENTER,
+                command=lambda column=column: self.sort_by(column),
+            )
+        self.refresh()
+
+    def clear(self):
+        self.df = None
+        self.first_row = 0
+        self.tree.delete(*self.tree.get_children())
+        self.tree.configure(columns=[])
+        self.scroll.set(0, 1)
+
+    def refresh(self):
+        self.tree.delete(*self.tree.get_children())
+        last_row = min(self.first_row + self.height, self.row_count)
+        rows = self.df.iloc[self.first_row : last_row].values.tolist()
+        for values in rows:
+            self.tree.insert(parent="", index="end", text="", values=values)
+        if self.row_count == 0:
+            self.scroll.set(0, 1)
+        else:
+            self.scroll.set(
+                self.first_row / self.row_count, last_row / self.row_count
+            )
+
+    def scroll_to(self, first_row):
+        last_start = max(self.row_count - self.height, 0)
+        first_row = min(max(int(first_row), 0), last_start)
+        if first_row != self.first_row:
+            self.first_row = first_row
+            self.refresh()
+
+    def scroll_rows(self, rows):
+        if self.df is not None:
+            self.scroll_to(self.first_row + rows)
+        return "break"
+
+    def yview(self, *args):
+        # Called by the scrollbar with either ("moveto", fraction) or
+        # ("scroll", number, "units"/"pages")
+        if self.df is None:
+            return
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * self.row_count)
+        elif args[0] == "scroll":
+            rows = int(args[1])
+            if args[2] == "pages":
+                rows *= self.height
+            self.scroll_rows(rows)
+
+    def on_mousewheel(self, event):
+        # Windows reports multiples of 120 while macOS reports single steps
+        steps = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self.scroll_rows(-steps)
+
+    def sort_by(self, column):
+        if self.sort_column == column:
+            self.sort_ascending = not self.sort_ascending
+        else:
+            self.sort_column = column
+            self.sort_ascending = True
+        # mergesort keeps the current order for rows that compare equal
+        self.df = self.df.sort_values(
+            column, ascending=self.sort_ascending, kind="mergesort"
+        )
+        for heading in self.df.columns:
+            text = heading
+            if heading == column:
+                text = f"{heading} {'▲' if self.sort_ascending else '▼'}"
+            self.tree.heading(heading, text=text)
+        self.first_row = 0
+        self.refresh()
@@ -0,0 +1,162 @@
+"""
+Generates synthetic pharmacoscan annot files for testing and benchmarking.
+
+The real annot file can't be redistributed so this writes a file with the same
+layout and quirks that create_probes_table.py has to deal with:
+- # comment lines before a quoted header row
+- Associated Gene entries made of 7 // separated fields per gene with
+  multiple genes joined by ///, occasionally with --- as the gene symbol
+- Extended RSID entries holding one or more comma separated rsIDs
+- --- for missing values
+
+Usage:
+python synthetic_annot.py --probe-sets 100000 --out synthetic.annot.csv
+"""
+import argparse
+import csv
+
+import numpy as np
+
+# A few real pharmacogenes so that queries for them return rows
+pgx_genes = [
+    "CYP2D6",
+    "CYP2C19",
+    "CYP2C9",
+    "CYP3A4",
+    "CYP3A5",
+    "CYP4F2",
+    "CYP2B6",
+    "SLCO1B1",
+    "VKORC1",
+    "TPMT",
+    "NUDT15",
+    "DPYD",
+    "UGT1A1",
+    "G6PD",
+    "IFNL3",
+    "HLA-A",
+    "HLA-B",
+    "RYR1",
+    "CACNA1S",
+    "CFTR",
+]
+chromosomes = [str(i) for i in range(1, 23)] + ["X", "Y", "MT"]
+relationships = ["intron", "exon", "upstream", "downstream", "UTR-3", "UTR-5"]
+header = [
+    "Probe Set ID",
+    "Affy SNP ID",
+    "dbSNP RS ID",
+    "Chromosome",
+    "Physical Position",
+    "Strand",
+    "Ref Allele",
+    "Alt Allele",
+    "Associated Gene",
+    "Probe Count",
+    "Extended RSID",
+]
+
+
+def gene_names(gene_count):
+    return pgx_genes + [f"GENE{i}" for i in range(max(gene_count - len(pgx_genes), 0))]
+
+
+def _associated_gene(rng, genes, gene_count):
+    entries = []
+    for _ in range(gene_count):
+        symbol = "---" if rng.random() < 0.02 else genes[rng.integers(len(genes))]
+        entries.append(
+            f"NM_{rng.integers(1, 999999):06d} // "
+            f"{relationships[rng.integers(len(relationships))]} // "
+            f"{rng.integers(0, 5000)} // Hs.{rng.integers(1, 99999)} // "
+            f"{symbol} // {rng.integers(1, 99999)} // "
+            f"{symbol.lower()} protein, family {rng.integers(1, 9)}"
+        )
+    return " /// ".join(entries)
+
+
+def generate_rows(probe_sets, seed=0, gene_count=2000, chunk_size=100000):
+    """Yields lists of annot rows, chunk_size rows at a time.
+
+    rsIDs are drawn from a pool a little smaller than the number of probe
+    sets so that some rsIDs are shared between probe sets like in the real
+    file.
+    """
+    rng = np.random.default_rng(seed)
+    genes = gene_names(gene_count)
+    rsid_pool = max(probe_sets * 9 // 10, 1)
+    for start in range(0, probe_sets, chunk_size):
+        rows = []
+        for i in range(start, min(start + chunk_size, probe_sets)):
+            if rng.random() < 0.1:
+                associated_gene = "---"
+            else:
+                associated_gene = _associated_gene(
+                    rng, genes, rng.choice([1, 1, 1, 2, 3])
+                )
+            draw = rng.random()
+            if draw < 0.08:
+                rsids = "---"
+            elif draw < 0.15:
+                rsids = ",".join(
+                    f"rs{rng.integers(1, rsid_pool + 1)}" for _ in range(2)
+                )
+            else:
+                rsids = f"rs{rng.integers(1, rsid_pool + 1)}"
+            if rng.random() < 0.02:
+                chromosome = "---"
+                position = "---"
+            else:
+                chromosome = chromosomes[rng.integers(len(chromosomes))]
+                position = str(rng.integers(1, 250_000_000))
+            ref = "ACGT-"[rng.integers(5)]
+            alt = "ACGT"[rng.integers(4)]
+            rows.append(
+                [
+                    f"AX-{100000000 + i}",
+                    f"Affx-{80000000 + i}",
+                    "---" if rsids == "---" else rsids.split(",")[0],
+                    chromosome,
+                    position,
+                    "+" if rng.random() < 0.5 else "-",
+                    ref,
+                    alt,
+                    associated_gene,
+                    str(rng.integers(1, 13)),
+                    rsids,
+                ]
+            )
+        yield rows
+
+
+def write_annot(out_file, probe_sets, seed=0, gene_count=2000):
+    with open(out_file, "w", newline="") as f:
+        f.write("#%chip_type=PharmacoScan_96F\n")
+        f.write("#%lib_set_name=PharmacoScan_96F\n")
+        f.write("#%lib_set_version=synthetic\n")
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow(header)
+        for rows in generate_rows(probe_sets, seed, gene_count):
+            writer.writerows(rows)
+    return out_file
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic pharmacoscan annot csv file."
+    )
+    parser.add_argument("--probe-sets", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--genes",
+        type=int,
+        default=2000,
+        help="Number of distinct gene symbols (default: %(default)s)",
+    )
+    parser.add_argument("--out", default="synthetic.annot.csv")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_annot(args.out, args.probe_sets, args.seed, args.genes)
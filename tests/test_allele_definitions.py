@@ -0,0 +1,27 @@
+import pandas as pd
+
+from app_utils import read_allele_definitions
+
+
+def test_rsid_only_definitions(tmp_path):
+    # The layout given in the README, without Chromosome and Position columns
+    (tmp_path / "cyp2c19.tsv").write_text(
+        "Gene\tAllele\trsID\n"
+        "CYP2C19\t*2\tRS4244285 \n"
+        "CYP2C19\t*3\trs4986893\n"
+    )
+    definitions = read_allele_definitions(str(tmp_path))
+    assert definitions["Allele"].tolist() == ["CYP2C19*2", "CYP2C19*3"]
+    assert definitions["rsID"].tolist() == ["rs4244285", "rs4986893"]
+    assert definitions["Chromosome"].isna().all()
+    assert definitions["Position"].isna().all()
+
+
+def test_position_only_definitions(tmp_path):
+    (tmp_path / "dpyd.tsv").write_text(
+        "Gene\tAllele\tChromosome\tPosition\nDPYD\t*2A\tchr1\t97450058\n"
+    )
+    definitions = read_allele_definitions(str(tmp_path))
+    assert definitions["Chromosome"].tolist() == ["1"]
+    assert definitions["Position"].tolist() == [97450058]
+    assert pd.isna(definitions["rsID"]).all()
@@ -0,0 +1,77 @@
+import csv
+
+import pytest
+
+import create_probes_table
+import synthetic_annot
+
+HEADER = ["Pharmacoscan query file"]
+CHUNKSIZE = 500
+
+
+def write_table(result, tmp_path, name):
+    # The table and manifest as create_probes_table.py writes them
+    data, column_types, manifest = result[:3]
+    table_file = tmp_path / f"{name}.csv"
+    manifest_file = tmp_path / f"{name}.manifest.csv"
+    create_probes_table.write_output(data, table_file, HEADER)
+    create_probes_table.write_manifest(manifest, column_types, manifest_file, HEADER)
+    return table_file, manifest_file
+
+
+def write_previous_annot(annot_file, out_file):
+    # An earlier release of the annot file that is missing some probe sets,
+    # has others that have since changed and some that have since been removed
+    with open(annot_file, newline="") as f:
+        comments = [next(f) for _ in range(3)]
+        rows = list(csv.reader(f))
+    previous = [rows[0]]
+    for i, row in enumerate(rows[1:]):
+        if i % 50 == 0:
+            continue
+        if i % 40 == 0:
+            row = row[:9] + [str(int(row[9]) + 1)] + row[10:]
+        previous.append(row)
+    for i in range(20):
+        previous.append(
+            [f"AX-9{i:08d}", f"Affx-9{i}", f"rs9{i}", "1", str(1000 + i), "+"]
+            + ["A", "G", "---", "4", f"rs9{i}"]
+        )
+    with open(out_file, "w", newline="") as f:
+        f.writelines(comments)
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerows(previous)
+
+
+@pytest.fixture(scope="module")
+def annot_file(tmp_path_factory):
+    out_file = tmp_path_factory.mktemp("annot") / "synthetic.annot.csv"
+    return synthetic_annot.write_annot(str(out_file), 3000, seed=1)
+
+
+def test_builds_are_identical(annot_file, tmp_path):
+    serial = create_probes_table.build_table(annot_file, CHUNKSIZE)
+    table_file, manifest_file = write_table(serial, tmp_path, "serial")
+
+    parallel = create_probes_table.build_table(annot_file, CHUNKSIZE, jobs=2)
+    parallel_files = write_table(parallel, tmp_path, "parallel")
+    assert parallel_files[0].read_bytes() == table_file.read_bytes()
+    assert parallel_files[1].read_bytes() == manifest_file.read_bytes()
+
+    previous_annot = tmp_path / "previous.annot.csv"
+    write_previous_annot(annot_file, previous_annot)
+    previous_files = write_table(
+        create_probes_table.build_table(str(previous_annot), CHUNKSIZE),
+        tmp_path,
+        "previous",
+    )
+    patched = create_probes_table.rebuild_table(
+        annot_file, *previous_files, chunksize=CHUNKSIZE
+    )
+    changes = patched[3]
+    assert len(changes["added"]) == 60
+    assert len(changes["removed"]) == 20
+    assert len(changes["changed"]) == 60
+    patched_files = write_table(patched, tmp_path, "patched")
+    assert patched_files[0].read_bytes() == table_file.read_bytes()
+    assert patched_files[1].read_bytes() == manifest_file.read_bytes()
@@ -0,0 +1,29 @@
+import pytest
+
+import app_utils
+from app_utils import QueryCancelled, TableStore, query_table
+
+TABLE = (
+    "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+    "AX-1,22,42126000,A,G,CYP2D6,9,rs86592\n"
+)
+
+
+def test_cancelled_query_stops(tmp_path, monkeypatch):
+    table_file = tmp_path / "pscan_table.csv"
+    table_file.write_text(TABLE)
+    monkeypatch.setattr(app_utils, "query_engine", "pandas")
+    monkeypatch.setattr(app_utils, "table_store", TableStore(str(table_file)))
+    regions = [f"22:{start}-{start + 10}" for start in range(42100000, 42130000)]
+    checks = []
+
+    def cancelled():
+        # Cancelled while the regions are being looked up
+        checks.append(None)
+        return len(checks) > 2
+
+    with pytest.raises(QueryCancelled):
+        query_table(regions, "region", cancelled=cancelled)
+    assert len(checks) == 3
+    # Nothing is cached for a query that didn't finish
+    assert query_table(regions, "region").shape[0] == len(regions)
@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+import app_utils
+import create_probes_table
+from app_utils import SqliteStore, TableStore, iter_ids, query_table
+
+HEADER = ["#Pharmacoscan query file"]
+TABLE = (
+    "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+    "AX-1,10,94781859,G,A,CYP2C19,10,rs4244285\n"
+    "AX-2,10,94852738,C,T,CYP2C19,6,rs12248560\n"
+    "AX-3,22,42126000,A,G,CYP2D6,9,rs86592\n"
+    "AX-4,22,42127000,C,T,CYP2D6,8,rs1065852\n"
+    "AX-5,22,42127000,C,-,CYP2D6,4,\n"
+    "AX-6,X,153764217,C,T,G6PD,12,rs1050828\n"
+    "AX-7,MT,1555,A,G,MT-RNR1,7,rs267606617\n"
+    "AX-8,1,97450058,C,T,DPYD,5,AFFX-1\n"
+)
+QUERIES = [
+    (["CYP2D6", "CYP2C19", "NOTAGENE"], "gene"),
+    (["G6PD"], "gene"),
+    (["rs1065852", "rs4244285", "rs1"], "rsid"),
+    (["AFFX-1", "rs267606617"], "rsid"),
+    (["chr22:42126000-42127000", "10:94781859-94781859"], "region"),
+    (["chrM:1-2000", "chrx:153764217-153764217", "5:1-100"], "region"),
+]
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    csv_file = tmp_path / "pscan_table.csv"
+    sqlite_file = tmp_path / "pscan_table.sqlite"
+    csv_file.write_text("\n".join(HEADER) + "\n" + TABLE)
+    create_probes_table.write_sqlite(str(csv_file), str(sqlite_file), HEADER)
+    monkeypatch.setattr(app_utils, "table_store", TableStore(str(csv_file)))
+    monkeypatch.setattr(app_utils, "sqlite_store", SqliteStore(str(sqlite_file)))
+
+
+@pytest.mark.parametrize("ids, data_type", QUERIES)
+def test_engines_return_the_same_rows(engines, ids, data_type):
+    # IDs are parsed the way the GUI and CLI parse them first
+    ids = list(iter_ids(ids, data_type))
+    pandas_result = query_table(ids, data_type, engine="pandas")
+    sqlite_result = query_table(ids, data_type, engine="sqlite")
+    assert pandas_result.shape[0] != 0
+    pd.testing.assert_frame_equal(pandas_result, sqlite_result)
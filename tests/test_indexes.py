@@ -0,0 +1,43 @@
+import io
+
+import pandas as pd
+
+from app_utils import ProbeTable, _filter_by_genes, _filter_by_rsids, _select_rows
+
+TABLE = (
+    "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+    "AX-1,22,42126000,A,G,CYP2D6,9,rs1065852\n"
+    "AX-2,10,94781859,G,A,CYP2C19,10,rs4244285\n"
+    "AX-3,22,42127000,C,T,CYP2D6,8,rs16947\n"
+    "AX-4,10,94781859,G,T,CYP2C19,6,rs4244285\n"
+    "AX-5,22,42127000,C,-,CYP2D6,4,\n"
+    "AX-6,1,97450058,C,T,DPYD,5,AFFX-1\n"
+    "AX-7,22,42128000,G,A,CYP2D6,7,rs1065852\n"
+    "AX-8,1,97450100,A,C,,5,rs3918290\n"
+)
+
+
+def read_table():
+    return pd.read_csv(io.StringIO(TABLE))
+
+
+def test_index_lookup_matches_isin():
+    text = read_table()
+    table = ProbeTable(text)
+    for genes in [["CYP2D6"], ["DPYD", "CYP2C19", "CYP2D6"], ["NOTAGENE"]]:
+        found = _select_rows(table.df, "Gene", genes, table.gene_index)
+        expected = text.loc[text["Gene"].isin(genes)]
+        assert found.index.tolist() == expected.index.tolist()
+        pd.testing.assert_frame_equal(
+            _filter_by_genes(table, genes),
+            _filter_by_genes(table, genes, use_index=False),
+        )
+    for rsids in [["rs4244285"], ["AFFX-1", "rs1065852", "rs1"], ["rs16947"] * 2]:
+        codes = table.rsid_codec.encode(rsids)
+        found = _select_rows(table.df, "rsID", codes, table.rsid_index)
+        expected = text.loc[text["rsID"].isin(rsids)]
+        assert found.index.tolist() == expected.index.tolist()
+        pd.testing.assert_frame_equal(
+            _filter_by_rsids(table, rsids),
+            _filter_by_rsids(table, rsids, use_index=False),
+        )
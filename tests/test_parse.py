@@ -0,0 +1,12 @@
+from app_utils import parse_region_text
+
+
+def test_comma_separated_regions():
+    assert parse_region_text("1:100-200,2:300-400") == ["1:100-200", "2:300-400"]
+
+
+def test_thousands_separators():
+    assert parse_region_text("chr22:42,126,000-42,131,000,chrX:1-5") == [
+        "22:42126000-42131000",
+        "X:1-5",
+    ]
@@ -0,0 +1,32 @@
+import pytest
+
+import app_utils
+import pscan_query
+
+TABLE = (
+    "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+    "AX-1,22,42126000,A,G,CYP2D6,9,rs1065852\n"
+)
+
+
+def test_no_ids_leaves_no_output(tmp_path, monkeypatch):
+    # main() swaps these for the --table and --engine given
+    monkeypatch.setattr(app_utils, "table_store", app_utils.table_store)
+    monkeypatch.setattr(app_utils, "query_engine", app_utils.query_engine)
+    table_file = tmp_path / "pscan_table.csv"
+    table_file.write_text(TABLE)
+    id_file = tmp_path / "ids.txt"
+    id_file.write_text("nothing to query\n")
+    out_file = tmp_path / "results.tsv"
+    argv = ["--rsid-file", str(id_file), "--out", str(out_file)]
+    argv += ["--table", str(table_file), "--engine", "pandas"]
+    assert pscan_query.main(argv) == pscan_query.EXIT_NO_IDS
+    assert not out_file.exists()
+
+
+def test_table_with_compare_is_rejected():
+    with pytest.raises(SystemExit) as ex:
+        pscan_query.parse_args(
+            ["--genes", "CYP2D6", "--compare", "r8,r9", "--table", "t.csv"]
+        )
+    assert ex.value.code == 2
@@ -0,0 +1,51 @@
+import os
+
+import pandas as pd
+import pytest
+
+import app_utils
+from app_utils import QueryCache, TableStore, _filter_table, query_table
+
+TABLE = (
+    "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+    "AX-1,22,42126000,A,G,CYP2D6,9,rs1065852\n"
+    "AX-2,10,94781859,G,A,CYP2C19,10,rs4244285\n"
+    "AX-3,22,42127000,C,T,CYP2D6,8,rs16947\n"
+)
+
+
+@pytest.fixture
+def table_file(tmp_path, monkeypatch):
+    table_file = tmp_path / "pscan_table.csv"
+    table_file.write_text(TABLE)
+    monkeypatch.setattr(app_utils, "query_engine", "pandas")
+    monkeypatch.setattr(app_utils, "table_store", TableStore(str(table_file)))
+    monkeypatch.setattr(app_utils, "query_cache", QueryCache())
+    return table_file
+
+
+def test_reordered_and_repeated_ids_hit(table_file):
+    cache = app_utils.query_cache
+    query_table(["CYP2D6", "CYP2C19"], "gene")
+    query_table(["rs1", "rs16947", "rs4244285"], "rsid")
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    genes = ["CYP2C19", "CYP2D6", "CYP2D6"]
+    rsids = ["rs4244285", "rs1", "rs16947", "rs1"]
+    gene_result = query_table(genes, "gene")
+    rsid_result = query_table(rsids, "rsid")
+    assert (cache.hits, cache.misses) == (2, 2)
+    # Cached results are laid out as if the IDs had been queried afresh
+    table = app_utils.table_store.get()
+    pd.testing.assert_frame_equal(gene_result, _filter_table(table, genes, "gene"))
+    pd.testing.assert_frame_equal(rsid_result, _filter_table(table, rsids, "rsid"))
+
+
+def test_changed_table_misses(table_file):
+    cache = app_utils.query_cache
+    assert query_table(["CYP2D6"], "gene").shape[0] == 2
+    table_file.write_text(TABLE + "AX-4,22,42128000,G,A,CYP2D6,7,rs3892097\n")
+    stat = table_file.stat()
+    os.utime(table_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert query_table(["CYP2D6"], "gene").shape[0] == 3
+    assert (cache.hits, cache.misses) == (0, 2)
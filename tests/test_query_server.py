@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pandas as pd
+import pytest
+
+import app_utils
+from app_utils import TableStore, query_table
+from query_server import QueryClient, QueryServer
+
+TABLE = (
+    "#Pharmacoscan query file\n"
+    "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+    "AX-1,10,94781859,G,A,CYP2C19,10,rs4244285\n"
+    "AX-2,22,42126000,A,G,CYP2D6,9,rs86592\n"
+    "AX-3,22,42127000,C,T,CYP2D6,8,rs1065852\n"
+)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # Serves a small table from a thread on a port chosen by the OS
+    table_file = tmp_path / "pscan_table.csv"
+    table_file.write_text(TABLE)
+    monkeypatch.setattr(app_utils, "query_engine", "pandas")
+    monkeypatch.setattr(app_utils, "table_store", TableStore(str(table_file)))
+    loop = asyncio.new_event_loop()
+    server = QueryServer(port=0, workers=1)
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(server.close())
+    loop.close()
+
+
+def test_query_matches_query_table(server):
+    ids = ["CYP2D6", "CYP2C19", "NOTAGENE"]
+    client = QueryClient(server.host, server.port, timeout=10)
+    result = client.query(ids, "gene")
+    expected = query_table(ids, "gene")
+    assert result.shape[0] == 3
+    pd.testing.assert_frame_equal(
+        result.astype(object).where(result.notna(), None),
+        expected.astype(object).where(expected.notna(), None),
+        check_dtype=False,
+    )
+
+
+def test_health(server):
+    health = QueryClient(server.host, server.port, timeout=10).health()
+    assert health["status"] == "ok"
+    assert health["rows"] == 3
@@ -0,0 +1,56 @@
+import pytest
+
+import app_utils
+from app_utils import ReleaseStore, compare_releases
+
+COLUMNS = "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+RELEASES = {
+    "r8": (
+        "AX-1,22,42126000,A,G,CYP2D6,9,rs1\n"
+        "AX-2,22,42127000,C,T,CYP2D6,8,rs2\n"
+        "AX-3,22,42128000,G,A,CYP2D6,7,rs3\n"
+    ),
+    "r9": (
+        "AX-1,22,42126000,A,G,CYP2D6,9,rs1\n"
+        "AX-2,22,42127000,C,T,CYP2D6,6,rs2\n"
+        "AX-4,22,42129000,T,C,CYP2D6,5,rs4\n"
+    ),
+}
+
+
+@pytest.fixture
+def releases(tmp_path, monkeypatch):
+    paths = {}
+    for version, rows in RELEASES.items():
+        paths[version] = tmp_path / f"pscan_table_{version}.csv"
+        paths[version].write_text(COLUMNS + rows)
+    monkeypatch.setattr(
+        ReleaseStore,
+        "paths",
+        staticmethod(lambda versions: {v: str(paths[v]) for v in versions}),
+    )
+    monkeypatch.setattr(app_utils, "release_store", ReleaseStore())
+
+
+def test_gene_changes(releases):
+    df = compare_releases(["CYP2D6"], ["r8", "r9"], "gene")
+    assert df["Probe Set ID"].tolist() == ["AX-1", "AX-2", "AX-3", "AX-4"]
+    assert df["r8 to r9"].tolist() == ["", "Changed", "Removed", "Added"]
+    assert df["On Array r8"].tolist() == ["Yes", "Yes", "Yes", "No"]
+    assert df["On Array r9"].tolist() == ["Yes", "Yes", "No", "Yes"]
+    # Values come from the newest release each row is in
+    assert df["Probe Count"].tolist() == [9, 6, 7, 5]
+
+
+def test_rsid_and_region_changes(releases):
+    df = compare_releases(["rs4", "rs3", "rs99"], ["r8", "r9"], "rsid")
+    assert df["rsID"].tolist() == ["rs3", "rs4", "rs99"]
+    assert df["r8 to r9"].fillna("").tolist() == ["Removed", "Added", ""]
+    assert df["On Array r9"].tolist() == ["No", "Yes", "No"]
+
+    df = compare_releases(
+        ["22:42127000-42128000", "1:1-10"], ["r8", "r9"], "region"
+    )
+    assert df["Region"].tolist() == ["22:42127000-42128000"] * 2 + ["1:1-10"]
+    assert df["r8 to r9"].fillna("").tolist() == ["Changed", "Removed", ""]
+    assert df["On Array r8"].tolist() == ["Yes", "Yes", "No"]
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from app_utils import RsidCodec
+
+
+def test_round_trip():
+    codec = RsidCodec()
+    rsids = ["rs4244285", "AFFX-SNP_1", None, "rs1", "Affx-2", "AFFX-SNP_1", "rs0"]
+    codes = codec.encode(rsids, add=True)
+    assert codes.dtype == np.uint64
+    assert codes[0] == 4244285
+    assert codes[2] == RsidCodec.missing
+    # IDs that aren't rs numbers are kept once in the side table
+    assert codec.others == ["AFFX-SNP_1", "Affx-2", "rs0"]
+    assert codes[1] == codes[5] >= RsidCodec.other_base
+    decoded = codec.decode(codes)
+    assert pd.isna(decoded[2])
+    assert list(decoded[[0, 1, 3, 4, 5, 6]]) == [
+        "rs4244285",
+        "AFFX-SNP_1",
+        "rs1",
+        "Affx-2",
+        "AFFX-SNP_1",
+        "rs0",
+    ]
+
+
+def test_queries_dont_grow_the_side_table():
+    codec = RsidCodec()
+    codec.encode(["AFFX-1"], add=True)
+    codes = codec.encode(["AFFX-1", "AFFX-2", "rs12"])
+    assert codes.tolist() == [RsidCodec.other_base, RsidCodec.unknown, 12]
+    assert codec.others == ["AFFX-1"]
+    assert codec.encode_one("AFFX-2") == RsidCodec.unknown
+    assert pd.isna(codec.decode(codes)[1])
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from app_utils import TableStore
+
+create_probes_table = pytest.importorskip("create_probes_table")
+pytest.importorskip("pyarrow.feather")
+
+TABLE = (
+    "#Pharmacoscan query file\n"
+    "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+    "AX-1,19,139979361,-,C,CYP2C19,10,rs174734\n"
+    "AX-2,22,42126000,A,G,CYP2D6,9,rs86592\n"
+)
+
+
+def test_stale_feather_is_ignored(tmp_path):
+    csv_file = tmp_path / "pscan_table.csv"
+    feather_file = tmp_path / "pscan_table.feather"
+    csv_file.write_text(TABLE)
+    create_probes_table.write_feather(
+        str(csv_file), str(feather_file), ["#Pharmacoscan query file"]
+    )
+    store = TableStore(str(csv_file))
+    assert store.path == str(feather_file)
+
+    # A newer csv downloaded over the one the Feather file was made from
+    csv_file.write_text(TABLE.replace("CYP2D6", "CYP3A5"))
+    stat = csv_file.stat()
+    os.utime(csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert store.path == str(csv_file)
+    assert "CYP3A5" in store.get().gene_index
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app_utils
+from app_utils import TableStore
+from vcf_annotate import _format_count, annotate_vcf
+
+
+def test_format_count():
+    assert _format_count(np.int64(12)) == "12"
+    assert _format_count(3.0) == "3"
+    for missing in [None, np.nan, pd.NA]:
+        assert _format_count(missing) == "."
+
+
+TABLE = (
+    "Probe Set ID,Chromosome,Position,Ref,Alt,Gene,Probe Count,rsID\n"
+    "AX-1,22,42126000,A,G,CYP2D6,9,rs1065852\n"
+)
+
+
+@pytest.fixture
+def vcf_file(tmp_path, monkeypatch):
+    table_file = tmp_path / "pscan_table.csv"
+    table_file.write_text(TABLE)
+    monkeypatch.setattr(app_utils, "query_engine", "pandas")
+    monkeypatch.setattr(app_utils, "table_store", TableStore(str(table_file)))
+    vcf_file = tmp_path / "sample.vcf"
+    with open(vcf_file, "w") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        for position in range(42100000, 42125000):
+            f.write(f"chr22\t{position}\t.\tA\tG\t.\tPASS\t.\n")
+    return vcf_file
+
+
+def test_cancelled_output_is_removed(vcf_file, tmp_path):
+    out_file = tmp_path / "sample.pscan.tsv"
+    records, _ = annotate_vcf(str(vcf_file), str(out_file), cancelled=lambda: True)
+    assert records == 10000
+    assert not out_file.exists()
+
+    assert annotate_vcf(str(vcf_file), str(out_file)) == (25000, 0)
+    assert out_file.exists()
+
+
+def test_sqlite_engine_is_rejected(vcf_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_utils, "query_engine", "sqlite")
+    out_file = tmp_path / "sample.pscan.vcf"
+    with pytest.raises(ValueError, match="SQLite"):
+        annotate_vcf(str(vcf_file), str(out_file))
+    assert not out_file.exists()
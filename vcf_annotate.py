@@ -0,0 +1,296 @@
+"""
+Annotates a VCF with which of its variants are on the pharmacoscan array.
+
+The VCF is streamed one record at a time, plain or gzipped/bgzipped, so
+memory use doesn't grow with the size of the VCF. Each record is joined
+against the lookup indexes the tool already keeps on the table:
+- by rsID, using every rsID in the ID column (IDs can be ; separated)
+- by chromosome, position, ref and alt through the region index. Alleles are
+  trimmed of the bases they share first so that VCF style indels with an
+  anchor base match the - style alleles used in the table
+
+The output is either the VCF with PSCAN_* INFO fields added or a tsv with
+one line per record. Output files ending in .gz are gzipped.
+
+Usage:
+python vcf_annotate.py sample.vcf.gz --out sample.pscan.vcf.gz
+python vcf_annotate.py sample.vcf --out sample.pscan.tsv
+"""
+import argparse
+import gzip
+import os
+import sys
+
+import pandas as pd
+
+import app_utils
+from app_utils import normalize_chromosome
+
+info_headers = [
+    '##INFO=<ID=PSCAN_ON_ARRAY,Number=0,Type=Flag,'
+    'Description="Variant is on the pharmacoscan array">',
+    '##INFO=<ID=PSCAN_PROBE_SET,Number=.,Type=String,'
+    'Description="Pharmacoscan probe set IDs for the variant">',
+    '##INFO=<ID=PSCAN_PROBE_COUNT,Number=.,Type=Integer,'
+    'Description="Probe count of each pharmacoscan probe set">',
+    '##INFO=<ID=PSCAN_MATCH,Number=1,Type=String,'
+    'Description="How the variant was matched: rsid, position or both">',
+]
+tsv_columns = [
+    "Chromosome",
+    "Position",
+    "ID",
+    "Ref",
+    "Alt",
+    "On Array",
+    "Probe Set ID",
+    "Probe Count",
+    "Match",
+]
+
+
+def _open_vcf(file_path):
+    # bgzip files are a series of gzip members so gzip reads them as is
+    with open(file_path, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(file_path, "rt", newline="")
+    return open(file_path, "r", newline="")
+
+
+def _open_output(file_path):
+    if file_path is None or file_path == "-":
+        return sys.stdout
+    if file_path.lower().endswith(".gz"):
+        return gzip.open(file_path, "wt", newline="")
+    return open(file_path, "w", newline="")
+
+
+def _trim_alleles(position, ref, alt):
+    # Drops the bases ref and alt share at the end and then at the start,
+    # moving the position past any dropped at the start. Empty alleles are
+    # written as - like in the table
+    while len(ref) > 1 and len(alt) > 1 and ref[-1] == alt[-1]:
+        ref = ref[:-1]
+        alt = alt[:-1]
+    while len(ref) != 0 and len(alt) != 0 and ref[0] == alt[0]:
+        ref = ref[1:]
+        alt = alt[1:]
+        position += 1
+    return position, ref or "-", alt or "-"
+
+
+class VcfAnnotator:
+    """Matches VCF records to probe sets using the loaded table's indexes."""
+
+    def __init__(self, table):
+        df = table.df
+        self.rsid_codec = table.rsid_codec
+        self.rsid_index = table.rsid_index
+        self.region_index = table.region_index
+        self.probe_sets = df["Probe Set ID"].to_numpy(dtype=object)
+        self.probe_counts = df["Probe Count"].to_numpy(dtype=object)
+        self.refs = df["Ref"].astype(object).fillna("").str.upper().to_numpy()
+        self.alts = df["Alt"].astype(object).fillna("").str.upper().to_numpy()
+        self._chromosomes = {}
+
+    def _match_position(self, chromosome, position, ref, alt):
+        position, ref, alt = _trim_alleles(position, ref, alt)
+        start = position
+        if ref == "-" or alt == "-":
+            # Indels may be placed on the base before them instead
+            start = position - 1
+        offsets = self.region_index.lookup(chromosome, start, position)
+        return [
+            offset
+            for offset in offsets
+            if (self.refs[offset], self.alts[offset]) in [(ref, alt), (alt, ref)]
+        ]
+
+    def match(self, chromosome, position, ids, ref, alts):
+        """Returns the table row offsets matching a record and how it matched."""
+        rsid_offsets = []
+        for id_ in ids.split(";"):
+            found = self.rsid_index.get(self.rsid_codec.encode_one(id_.lower()))
+            if found is not None:
+                rsid_offsets.extend(found)
+        position_offsets = []
+        # Records come sorted so the same few chromosome names repeat
+        normalized = self._chromosomes.get(chromosome)
+        if normalized is None:
+            normalized = normalize_chromosome(chromosome)
+            self._chromosomes[chromosome] = normalized
+        chromosome = normalized
+        ref = ref.upper()
+        for alt in alts.split(","):
+            alt = alt.upper()
+            if alt in [".", "*"] or alt.startswith("<") or "[" in alt or "]" in alt:
+                continue
+            position_offsets.extend(
+                self._match_position(chromosome, position, ref, alt)
+            )
+        if len(rsid_offsets) != 0 and len(position_offsets) != 0:
+            how = "both"
+        elif len(rsid_offsets) != 0:
+            how = "rsid"
+        elif len(position_offsets) != 0:
+            how = "position"
+        else:
+            how = None
+        return rsid_offsets + position_offsets, how
+
+    def probe_sets_for(self, offsets):
+        # One entry per probe set since the table has a row per gene and rsID
+        probe_sets = {}
+        for offset in offsets:
+            probe_sets.setdefault(self.probe_sets[offset], self.probe_counts[offset])
+        return probe_sets
+
+
+def find_format(file_path):
+    # tsv for .tsv and .txt outputs, gzipped or not, otherwise vcf
+    if file_path is None or file_path == "-":
+        return "vcf"
+    name = file_path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return "tsv" if os.path.splitext(name)[-1] in [".tsv", ".txt"] else "vcf"
+
+
+def _format_count(count):
+    # Missing counts come through as None, NaN or pd.NA depending on the
+    # Probe Count dtype
+    if pd.isna(count):
+        return "."
+    return str(int(count))
+
+
+def annotate_vcf(
+    file_path_in, file_path_out, file_format=None, progress=None, cancelled=None
+):
+    """Writes an annotated copy of a VCF as a VCF or tsv.
+
+    progress is called with the number of records read every 10,000 records
+    and cancelled is checked as often, stopping early when it returns True.
+    An output file that isn't finished, because of cancelling or an error, is
+    removed. Returns the number of records read and how many were on the
+    array.
+
+    Records are matched with the lookup indexes of the table held in memory,
+    so a ValueError is raised when the SQLite query engine is selected.
+    """
+    if app_utils.query_engine == "sqlite":
+        raise ValueError(
+            "VCF annotation needs the table held in memory and can't use the "
+            "SQLite query engine. Set PSCAN_QUERY_ENGINE to pandas"
+        )
+    if file_format is None:
+        file_format = find_format(file_path_out)
+    annotator = VcfAnnotator(app_utils.get_store().get())
+    records = 0
+    on_array = 0
+    finished = False
+    with _open_vcf(file_path_in) as f_in:
+        f_out = _open_output(file_path_out)
+        try:
+            if file_format == "tsv":
+                f_out.write("\t".join(tsv_columns) + "\n")
+            for line in f_in:
+                if line.startswith("##"):
+                    if file_format == "vcf":
+                        f_out.write(line)
+                    continue
+                if line.startswith("#"):
+                    if file_format == "vcf":
+                        f_out.write("\n".join(info_headers) + "\n")
+                        f_out.write(line)
+                    continue
+                fields = line.rstrip("\r\n").split("\t")
+                if len(fields) < 8:
+                    continue
+                records += 1
+                if records % 10000 == 0:
+                    if cancelled is not None and cancelled():
+                        return records, on_array
+                    if progress is not None:
+                        progress(records)
+                chromosome, position, ids, ref, alts = fields[:5]
+                offsets, how = annotator.match(
+                    chromosome, int(position), ids, ref, alts
+                )
+                probe_sets = annotator.probe_sets_for(offsets)
+                if how is not None:
+                    on_array += 1
+                if file_format == "vcf":
+                    if how is not None:
+                        info = [
+                            "PSCAN_ON_ARRAY",
+                            "PSCAN_PROBE_SET=" + ",".join(probe_sets),
+                            "PSCAN_PROBE_COUNT="
+                            + ",".join(map(_format_count, probe_sets.values())),
+                            f"PSCAN_MATCH={how}",
+                        ]
+                        if fields[7] not in ["", "."]:
+                            info.insert(0, fields[7])
+                        fields[7] = ";".join(info)
+                    f_out.write("\t".join(fields) + "\n")
+                else:
+                    row = [
+                        chromosome,
+                        position,
+                        ids,
+                        ref,
+                        alts,
+                        "Yes" if how is not None else "No",
+                        ",".join(probe_sets),
+                        ",".join(map(_format_count, probe_sets.values())),
+                        how or "",
+                    ]
+                    f_out.write("\t".join(row) + "\n")
+            finished = True
+        finally:
+            if f_out is sys.stdout:
+                f_out.flush()
+            else:
+                f_out.close()
+                if not finished:
+                    os.remove(file_path_out)
+    return records, on_array
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Mark which variants in a VCF are on the pharmacoscan array."
+    )
+    parser.add_argument("vcf", help="Plain, gzipped or bgzipped VCF")
+    parser.add_argument(
+        "--out",
+        help="Output file, gzipped if it ends in .gz. Written to stdout if not "
+        "given",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["vcf", "tsv"],
+        help="Output format. Defaults to tsv for .tsv/.txt outputs, otherwise vcf",
+    )
+    parser.add_argument(
+        "--table", help="Pharmacoscan table to query instead of the default"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.table is not None:
+        app_utils.table_store = app_utils.TableStore(os.path.abspath(args.table))
+    try:
+        records, on_array = annotate_vcf(args.vcf, args.out, args.format)
+    except (OSError, UnicodeDecodeError, ValueError) as ex:
+        print(f"Unable to annotate VCF: {ex}", file=sys.stderr)
+        return 1
+    print(f"{on_array} of {records} records are on the array", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())